@@ -1,17 +1,12 @@
-import sqlite3
-
-conn = sqlite3.connect("weather.db")
-cursor = conn.cursor()
+from sqlalchemy import inspect, text
+from database import engine
 
 # Add last_login column if it doesn't exist
-cursor.execute("PRAGMA table_info(users);")
-columns = [col[1] for col in cursor.fetchall()]
+columns = [col["name"] for col in inspect(engine).get_columns("users")]
 
 if "last_login" not in columns:
-    cursor.execute("ALTER TABLE users ADD COLUMN last_login DATETIME;")
-    conn.commit()
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE users ADD COLUMN last_login TIMESTAMP"))
     print("✅ Added 'last_login' column to users table.")
 else:
     print("ℹ️ 'last_login' column already exists.")
-
-conn.close()
@@ -0,0 +1,262 @@
+"""
+Micro-benchmarks for the request hot path in main.py.
+
+Each benchmark is calibrated to run for at least --min-time per sample, then
+sampled --samples times; the median per-call time is the headline number.
+
+    python bench.py --json bench.json                 # run and save
+    python bench.py --compare bench.json --threshold 0.15   # fail on >15% regressions
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+from datetime import datetime
+
+# Keep the benchmark away from the real database, the shared cache files, the demo user and log output
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "weather.db"))
+os.environ.setdefault("CREATE_DEMO_USER", "0")
+os.environ.setdefault("PREFETCH_ENABLED", "0")
+os.environ.setdefault("CACHE_BACKEND", "none")
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from jose import jwt
+
+import main
+from database import make_async_engine, make_engine
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+# --- Fixtures ---
+# One loop for every async benchmark: aiosqlite connections are bound to the loop that opened them
+LOOP = asyncio.new_event_loop()
+
+
+def run_async(make_coro):
+    """
+    Wraps a coroutine factory as a plain callable; the numbers include one loop round trip.
+    """
+    return lambda: LOOP.run_until_complete(make_coro())
+
+
+SESSIONS = []  # closed after the run
+
+
+def make_session() -> AsyncSession:
+    # File-backed so commits pay for a real journal write, like weather.db does
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = make_engine(f"sqlite:///{path}")
+    main.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(main.User), [{"username": "bench@example.com", "hashed_password": "x"}])
+    engine.dispose()
+    db = AsyncSession(make_async_engine(f"sqlite+aiosqlite:///{path}"), expire_on_commit=False)
+    SESSIONS.append(db)
+    return db
+
+
+async def close_sessions():
+    for db in SESSIONS:
+        await db.close()
+        await db.bind.dispose()
+    SESSIONS.clear()
+
+
+def sample_weather() -> dict:
+    return {"coord": {"lon": 36.82, "lat": -1.28}, "id": 184745, "name": "Nairobi", "cod": 200,
+            "weather": [{"id": 801, "main": "Clouds", "description": "few clouds", "icon": "02d"}],
+            "main": {"temp": 22.4, "feels_like": 22.1, "pressure": 1019, "humidity": 60},
+            "wind": {"speed": 4.1, "deg": 60}}
+
+
+def sample_forecast() -> dict:
+    rng = random.Random(1)
+    items = [{"dt": 1700000000 + i * 10800, "dt_txt": f"2026-01-{1 + i // 8:02d} {i % 8 * 3:02d}:00:00",
+              "main": {"temp": round(rng.uniform(10, 30), 2), "humidity": rng.randint(20, 90)},
+              "weather": [{"description": "scattered clouds"}], "wind": {"speed": round(rng.uniform(0, 10), 1)}}
+             for i in range(40)]
+    return {"cod": "200", "cnt": 40, "list": items, "city": {"name": "Nairobi"}}
+
+
+# --- Benchmarks ---
+@benchmark("create_access_token")
+def bench_create_token():
+    return lambda: main.create_access_token({"sub": "bench@example.com"})
+
+
+@benchmark("jwt_decode")
+def bench_jwt_decode():
+    token = main.create_access_token({"sub": "bench@example.com"})
+    return lambda: jwt.decode(token, main.SECRET_KEY, algorithms=[main.ALGORITHM])
+
+
+@benchmark("decode_token_cached")
+def bench_decode_token_cached():
+    token = main.create_access_token({"sub": "bench@example.com"})
+    return lambda: main.decode_token(token)
+
+
+@benchmark("get_user")
+def bench_get_user():
+    db = make_session()
+    return run_async(lambda: main.get_user(db, "bench@example.com"))
+
+
+@benchmark("get_current_user")
+def bench_get_current_user():
+    # A token as /token issues it (uid/ver/sid claims), so this is the default stateless path
+    db = make_session()
+    user = LOOP.run_until_complete(main.get_user(db, "bench@example.com"))
+    token = LOOP.run_until_complete(main.issue_tokens(db, user))["access_token"]
+    return run_async(lambda: main.get_current_user(token, db))
+
+
+@benchmark("get_current_user_db_lookup")
+def bench_get_current_user_db_lookup():
+    # Tokens without uid/ver claims fall back to a users lookup on every request
+    db = make_session()
+    token = main.create_access_token({"sub": "bench@example.com"})
+    return run_async(lambda: main.get_current_user(token, db))
+
+
+@benchmark("search_history_insert_commit")
+def bench_history_insert():
+    db = make_session()
+    return run_async(lambda: main.save_searches(db, ["Nairobi"]))
+
+
+@benchmark("forecast_summary")
+def bench_forecast_summary():
+    data = sample_forecast()
+    return lambda: main.forecast_summary(data, "Nairobi")
+
+
+@benchmark("weather_response_serialize")
+def bench_serialize():
+    body = {"city": "Nairobi", **main.weather_summary(sample_weather()), "saved_id": 123,
+            "time": datetime.now().strftime("%H:%M:%S"), "date": datetime.now().strftime("%Y-%m-%d")}
+    return lambda: JSONResponse(jsonable_encoder(body)).body
+
+
+@benchmark("forecast_response_serialize")
+def bench_forecast_serialize():
+    body = main.forecast_summary(sample_forecast(), "Nairobi")
+    return lambda: JSONResponse(jsonable_encoder(body)).body
+
+
+# --- Runner ---
+def measure(fn, samples: int, min_time: float) -> dict:
+    fn()  # warm up caches and lazy imports
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    per_call = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_call.append((time.perf_counter() - start) / loops)
+    per_call.sort()
+    quartiles = statistics.quantiles(per_call, n=4) if len(per_call) > 1 else [per_call[0]] * 3
+    us = lambda v: round(v * 1e6, 3)
+    return {
+        "loops": loops,
+        "samples": samples,
+        "median_us": us(statistics.median(per_call)),
+        "min_us": us(per_call[0]),
+        "mean_us": us(statistics.fmean(per_call)),
+        "stdev_us": us(statistics.stdev(per_call)) if len(per_call) > 1 else 0.0,
+        "iqr_us": us(quartiles[2] - quartiles[0]),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns (name, baseline_us, current_us, change) for every benchmark slower than `threshold`.
+    """
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        change = current["median_us"] / before["median_us"] - 1
+        print(f"  {name:<32}{before['median_us']:>12.2f}{current['median_us']:>12.2f}{change:>+10.1%}")
+        if change > threshold:
+            regressions.append((name, before["median_us"], current["median_us"], change))
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Hot-path micro-benchmarks")
+    parser.add_argument("--filter", default="", help="only run benchmarks containing this text")
+    parser.add_argument("--samples", type=int, default=15)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per sample")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed median slowdown, e.g. 0.10 = 10%%")
+    parser.add_argument("--with-logging", action="store_true", help="keep INFO logging on (off by default to avoid I/O noise)")
+    args = parser.parse_args()
+
+    if not args.with_logging:
+        logging.disable(logging.INFO)
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(setup(), args.samples, args.min_time)
+        r = results[name]
+        print(f"{name:<32}{r['median_us']:>12.2f} µs  (±{r['iqr_us']:.2f} IQR, {r['loops']} loops × {r['samples']})")
+    LOOP.run_until_complete(close_sessions())
+    LOOP.close()
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.utcnow().isoformat(),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nvs {args.compare}:\n  {'benchmark':<32}{'base µs':>12}{'now µs':>12}{'change':>10}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}:")
+            for name, before, now, change in regressions:
+                print(f"  {name}: {before:.2f} → {now:.2f} µs ({change:+.1%})")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,16 +1,14 @@
-import sqlite3
-
-conn = sqlite3.connect("weather.db")
-cursor = conn.cursor()
+from sqlalchemy import text
+from database import engine
 
+# Reads the hourly rollups rather than scanning search_history
 print("Top 5 Most Searched Cities:")
-for row in cursor.execute("""
-    SELECT city, COUNT(*) AS searches
-    FROM search_history
-    GROUP BY city
-    ORDER BY searches DESC
-    LIMIT 5;
-"""):
-    print(f"{row[0]} → {row[1]} searches")
-
-conn.close()
+with engine.connect() as conn:
+    for row in conn.execute(text("""
+        SELECT city, SUM(searches) AS searches
+        FROM search_rollup
+        GROUP BY city
+        ORDER BY searches DESC
+        LIMIT 5
+    """)):
+        print(f"{row[0]} → {row[1]} searches")
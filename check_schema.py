@@ -1,14 +1,7 @@
-import sqlite3
-
-conn = sqlite3.connect("weather.db")
-cursor = conn.cursor()
+from sqlalchemy import inspect
+from database import engine
 
 # Get schema of the users table
-cursor.execute("PRAGMA table_info(users)")
-columns = cursor.fetchall()
-
 print("Users table columns:")
-for col in columns:
+for col in inspect(engine).get_columns("users"):
     print(col)
-
-conn.close()
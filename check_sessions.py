@@ -1,9 +1,6 @@
-import sqlite3
+from sqlalchemy import text
+from database import engine
 
-conn = sqlite3.connect("weather.db")
-c = conn.cursor()
-
-for row in c.execute("SELECT id, user_id, jti, issued_at, expires_at, revoked, client_info FROM user_sessions ORDER BY issued_at DESC;"):
-    print(row)
-
-conn.close()
+with engine.connect() as conn:
+    for row in conn.execute(text("SELECT id, user_id, jti, issued_at, expires_at, revoked, client_info FROM user_sessions ORDER BY issued_at DESC")):
+        print(tuple(row))
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Importing main opens the database and may start background work; keep tests off weather.db and the network
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("CREATE_DEMO_USER", "0")
+os.environ.setdefault("PREFETCH_ENABLED", "0")
+os.environ.setdefault("CACHE_BACKEND", "none")
+os.environ.setdefault("RETENTION_INTERVAL_HOURS", "0")
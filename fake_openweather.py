@@ -0,0 +1,252 @@
+"""
+Local stand-in for the OpenWeather API, for load tests and benchmarks.
+
+Serves /data/2.5/weather, /data/2.5/forecast and /data/2.5/group with
+synthetic payloads shaped like the real ones, plus configurable latency,
+error rate and rate limiting. Point the app at it with:
+
+    uvicorn fake_openweather:app --port 9001
+    OPENWEATHER_BASE_URL=http://127.0.0.1:9001/data/2.5 uvicorn main:app
+"""
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Settings ---
+LATENCY_MS = float(os.getenv("FAKE_OW_LATENCY_MS", "80"))            # median latency
+LATENCY_DIST = os.getenv("FAKE_OW_LATENCY_DIST", "lognormal")        # fixed | uniform | exponential | lognormal
+LATENCY_SIGMA = float(os.getenv("FAKE_OW_LATENCY_SIGMA", "0.5"))     # lognormal spread
+ERROR_RATE = float(os.getenv("FAKE_OW_ERROR_RATE", "0"))             # fraction answered with a 5xx
+RATE_LIMIT_PER_MINUTE = int(os.getenv("FAKE_OW_RATE_LIMIT", "0"))    # 0 = unlimited
+UNKNOWN_CITIES = {c.strip().lower() for c in os.getenv("FAKE_OW_UNKNOWN_CITIES", "atlantis").split(",") if c.strip()}
+CITY_DATASET_PATH = os.getenv("CITY_DATASET_PATH", os.path.join("data", "cities.json"))
+GROUP_LIMIT = 20
+
+rng = random.Random(int(os.getenv("FAKE_OW_SEED", "0")) or None)
+
+app = FastAPI(title="Fake OpenWeather")
+
+# --- Known Cities ---
+cities_by_name, cities_by_id = {}, {}
+if os.path.exists(CITY_DATASET_PATH):
+    with open(CITY_DATASET_PATH, encoding="utf-8") as f:
+        for row in json.load(f):
+            cities_by_name.setdefault(row["name"].lower(), row)
+            cities_by_id[row["id"]] = row
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha1(text.encode()).hexdigest()[:12], 16)
+
+
+def synthetic_city(name: str) -> dict:
+    """
+    Known cities come from the dataset; anything else gets a stable made-up id and location.
+    """
+    known = cities_by_name.get(name.lower())
+    if known:
+        return known
+    h = _digest(name.lower())
+    city = {
+        "id": 10_000_000 + h % 1_000_000,
+        "name": name.title(),
+        "country": "ZZ",
+        "coord": {"lat": round((h % 14000) / 100 - 70, 4), "lon": round((h // 14000 % 36000) / 100 - 180, 4)},
+    }
+    cities_by_id.setdefault(city["id"], city)
+    return city
+
+
+def city_at(lat: float, lon: float) -> dict:
+    if cities_by_id:
+        nearest = min(cities_by_id.values(),
+                      key=lambda c: (c["coord"]["lat"] - lat) ** 2 + (c["coord"]["lon"] - lon) ** 2)
+        if abs(nearest["coord"]["lat"] - lat) < 0.5 and abs(nearest["coord"]["lon"] - lon) < 0.5:
+            return nearest
+    return {"id": 20_000_000 + _digest(f"{lat:.2f},{lon:.2f}") % 1_000_000, "name": "", "country": "",
+            "coord": {"lat": lat, "lon": lon}}
+
+
+CONDITIONS = [
+    (800, "Clear", "clear sky", "01d"),
+    (801, "Clouds", "few clouds", "02d"),
+    (803, "Clouds", "broken clouds", "04d"),
+    (500, "Rain", "light rain", "10d"),
+    (501, "Rain", "moderate rain", "10d"),
+    (211, "Thunderstorm", "thunderstorm", "11d"),
+]
+
+
+def conditions(city: dict, dt: int) -> dict:
+    # Deterministic per city and hour, with a daily temperature cycle
+    h = _digest(f"{city['id']}:{dt // 3600}")
+    base = 28 - abs(city["coord"]["lat"]) * 0.45
+    temp = round(base + 6 * math.sin((dt % 86400) / 86400 * 2 * math.pi) + (h % 300) / 100 - 1.5, 2)
+    code, main, description, icon = CONDITIONS[h % len(CONDITIONS)]
+    return {
+        "weather": [{"id": code, "main": main, "description": description, "icon": icon}],
+        "main": {
+            "temp": temp,
+            "feels_like": round(temp - (h % 20) / 10, 2),
+            "temp_min": round(temp - 1.5, 2),
+            "temp_max": round(temp + 1.5, 2),
+            "pressure": 1000 + h % 30,
+            "humidity": 30 + h % 65,
+        },
+        "visibility": 10000,
+        "wind": {"speed": round((h % 120) / 10, 1), "deg": h % 360},
+        "clouds": {"all": h % 100},
+    }
+
+
+def current_weather(city: dict) -> dict:
+    now = int(time.time())
+    return {
+        "coord": {"lon": city["coord"]["lon"], "lat": city["coord"]["lat"]},
+        **conditions(city, now),
+        "base": "stations",
+        "dt": now,
+        "sys": {"country": city.get("country", ""), "sunrise": now - now % 86400 + 10800,
+                "sunset": now - now % 86400 + 54000},
+        "timezone": 0,
+        "id": city["id"],
+        "name": city["name"],
+        "cod": 200,
+    }
+
+
+def forecast(city: dict) -> dict:
+    start = int(time.time()) // 10800 * 10800 + 10800
+    items = []
+    for i in range(40):
+        dt = start + i * 10800
+        items.append({
+            "dt": dt,
+            **conditions(city, dt),
+            "pop": 0,
+            "sys": {"pod": "d"},
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+        })
+    return {
+        "cod": "200",
+        "message": 0,
+        "cnt": len(items),
+        "list": items,
+        "city": {"id": city["id"], "name": city["name"], "coord": city["coord"],
+                 "country": city.get("country", ""), "timezone": 0},
+    }
+
+
+# --- Failure Injection ---
+stats = {"requests": 0, "by_endpoint": {}, "rate_limited": 0, "errors": 0}
+_window = {"start": time.monotonic(), "count": 0}
+
+
+async def simulate(endpoint: str, request: Request):
+    """
+    Applies latency, rate limiting and error injection. Returns a response to short-circuit with, or None.
+    """
+    stats["requests"] += 1
+    stats["by_endpoint"][endpoint] = stats["by_endpoint"].get(endpoint, 0) + 1
+
+    if LATENCY_MS > 0:
+        if LATENCY_DIST == "fixed":
+            delay = LATENCY_MS
+        elif LATENCY_DIST == "uniform":
+            delay = rng.uniform(0, 2 * LATENCY_MS)
+        elif LATENCY_DIST == "exponential":
+            delay = rng.expovariate(1 / LATENCY_MS)
+        else:
+            delay = rng.lognormvariate(math.log(LATENCY_MS), LATENCY_SIGMA)
+        await asyncio.sleep(delay / 1000)
+
+    if not request.query_params.get("appid"):
+        return JSONResponse({"cod": 401, "message": "Invalid API key. Please see https://openweathermap.org/faq#error401 for more info."},
+                            status_code=401)
+
+    if RATE_LIMIT_PER_MINUTE:
+        now = time.monotonic()
+        if now - _window["start"] >= 60:
+            _window["start"], _window["count"] = now, 0
+        _window["count"] += 1
+        if _window["count"] > RATE_LIMIT_PER_MINUTE:
+            stats["rate_limited"] += 1
+            return JSONResponse({"cod": 429, "message": "Your account is temporary blocked due to exceeding of requests limitation of your subscription type."},
+                                status_code=429)
+
+    if ERROR_RATE and rng.random() < ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"cod": "500", "message": "Internal server error"}, status_code=500)
+    return None
+
+
+def resolve(request: Request):
+    params = request.query_params
+    if "id" in params:
+        return cities_by_id.get(int(params["id"]))
+    if "q" in params:
+        name = params["q"].split(",")[0].strip()
+        return None if name.lower() in UNKNOWN_CITIES else synthetic_city(name)
+    if "lat" in params and "lon" in params:
+        return city_at(float(params["lat"]), float(params["lon"]))
+    return None
+
+
+def not_found():
+    return JSONResponse({"cod": "404", "message": "city not found"}, status_code=404)
+
+
+# --- Routes ---
+@app.get("/data/2.5/weather")
+async def weather(request: Request):
+    failure = await simulate("weather", request)
+    if failure:
+        return failure
+    city = resolve(request)
+    return current_weather(city) if city else not_found()
+
+
+@app.get("/data/2.5/forecast")
+async def get_forecast(request: Request):
+    failure = await simulate("forecast", request)
+    if failure:
+        return failure
+    city = resolve(request)
+    return forecast(city) if city else not_found()
+
+
+@app.get("/data/2.5/group")
+async def group(request: Request):
+    failure = await simulate("group", request)
+    if failure:
+        return failure
+    ids = [int(i) for i in request.query_params.get("id", "").split(",") if i.strip()]
+    if not ids or len(ids) > GROUP_LIMIT:
+        return JSONResponse({"cod": "400", "message": f"Between 1 and {GROUP_LIMIT} ids are allowed"}, status_code=400)
+    found = [current_weather(cities_by_id[i]) for i in ids if i in cities_by_id]
+    for item in found:
+        del item["cod"]
+    return {"cnt": len(found), "list": found}
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.getenv("PORT", 9001))
+    print(f"🌦 Fake OpenWeather on port {port} (latency {LATENCY_MS}ms {LATENCY_DIST}, error rate {ERROR_RATE})")
+    uvicorn.run("fake_openweather:app", host="127.0.0.1", port=port, reload=False)
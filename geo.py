@@ -0,0 +1,164 @@
+import gzip
+import json
+import math
+import logging
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE_LAT = 111.32
+EARTH_RADIUS_KM = 6371.0
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+class Cell(NamedTuple):
+    key: str      # stable cell id, used for cache keys
+    lat: float    # cell centre, used for the upstream request
+    lon: float
+
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, ch, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if value >= mid:
+            ch |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[ch])
+            bits, ch = 0, 0
+    return "".join(chars)
+
+
+def geohash_center(geohash: str) -> tuple:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for c in geohash:
+        ch = _GEOHASH_ALPHABET.index(c)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (ch >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+class CoordinateGrid:
+    """
+    Snaps coordinates to a grid so nearby requests share one cache entry and
+    one upstream fetch.
+
+    Either square-ish cells of `cell_km` (longitude step widened by latitude so
+    cells stay about the same size) or geohash cells of `geohash_precision`
+    characters. With neither set, coordinates pass through unchanged.
+    """
+    def __init__(self, cell_km: float = 1.0, geohash_precision: Optional[int] = None):
+        self.cell_km = cell_km
+        self.geohash_precision = geohash_precision
+
+    def snap(self, lat: float, lon: float) -> Cell:
+        if self.geohash_precision:
+            gh = geohash_encode(lat, lon, self.geohash_precision)
+            c_lat, c_lon = geohash_center(gh)
+            return Cell(f"gh:{gh}", round(c_lat, 5), round(c_lon, 5))
+        if not self.cell_km or self.cell_km <= 0:
+            return Cell(f"pt:{lat},{lon}", lat, lon)
+
+        lat_step = self.cell_km / KM_PER_DEGREE_LAT
+        row = math.floor((lat + 90) / lat_step)
+        c_lat = min(90.0, -90 + (row + 0.5) * lat_step)
+        # A whole number of columns per row, so the last one doesn't run past the dateline
+        cols = max(1, math.floor(360 / (lat_step / max(math.cos(math.radians(c_lat)), 1e-6))))
+        lon_step = 360 / cols
+        col = min(cols - 1, math.floor(((lon + 180) % 360) / lon_step))
+        c_lon = -180 + (col + 0.5) * lon_step
+        return Cell(f"km{self.cell_km}:{row}:{col}", round(c_lat, 5), round(c_lon, 5))
+
+
+# --- Nearest City Index ---
+class City(NamedTuple):
+    id: int       # OpenWeather city id
+    name: str
+    country: str
+    lat: float
+    lon: float
+
+
+def _unit_vector(lat: float, lon: float) -> tuple:
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def load_cities(path: str) -> List[City]:
+    """
+    Reads OpenWeather's city.list.json format (plain or .gz).
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        rows = json.load(f)
+    return [City(int(r["id"]), r["name"], r.get("country", ""), float(r["coord"]["lat"]), float(r["coord"]["lon"]))
+            for r in rows]
+
+
+class CityIndex:
+    """
+    k-d tree over cities as points on the unit sphere, so straight-line
+    (chord) distance orders results the same way great-circle distance does.
+    """
+    def __init__(self, cities: List[City]):
+        self.cities = cities
+        points = [(_unit_vector(c.lat, c.lon), i) for i, c in enumerate(cities)]
+        self._root = self._build(points, 0)
+
+    @classmethod
+    def from_file(cls, path: str) -> "CityIndex":
+        index = cls(load_cities(path))
+        logger.info(f"Loaded {len(index.cities)} cities from {path}")
+        return index
+
+    def _build(self, points: list, depth: int):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return (points[mid], axis,
+                self._build(points[:mid], depth + 1),
+                self._build(points[mid + 1:], depth + 1))
+
+    def nearest(self, lat: float, lon: float) -> Optional[tuple]:
+        """
+        Returns (city, distance_km) for the closest city, or None if the index is empty.
+        """
+        if self._root is None:
+            return None
+        tx, ty, tz = target = _unit_vector(lat, lon)
+        best_i, best_d2 = -1, float("inf")
+        stack = [(self._root, 0.0)]  # node, lower bound on its squared distance
+        while stack:
+            node, bound = stack.pop()
+            if node is None or bound >= best_d2:
+                continue
+            ((x, y, z), i), axis, left, right = node
+            d2 = (x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2
+            if d2 < best_d2:
+                best_i, best_d2 = i, d2
+            diff = target[axis] - (x, y, z)[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        chord = math.sqrt(best_d2)
+        return self.cities[best_i], 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+    def __len__(self):
+        return len(self.cities)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """
+    Write-behind buffer for search history. Requests enqueue (city, timestamp)
+    events without waiting, and a background task writes them with
+    `write(events)` in batches of up to `batch_size`, at least every
+    `flush_interval` seconds. When the queue is full new events are dropped
+    and counted rather than slowing requests down.
+    """
+    def __init__(self, write: Callable[[List[Tuple[str, datetime]]], None],
+                 queue_size: int = 10000, batch_size: int = 500, flush_interval: float = 1.0):
+        self.write = write
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.ensure_future(self._run())
+            logger.info("History writer started")
+
+    async def stop(self):
+        """
+        Stops the writer after flushing everything still queued.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self._inflight is not None:
+                await self._inflight
+            while not self._queue.empty():
+                await self._flush(self._take(self.batch_size))
+            logger.info(f"History writer stopped ({self.written} written, {self.dropped} dropped)")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def add(self, cities: List[str]):
+        now = datetime.utcnow()
+        for city in cities:
+            try:
+                self._queue.put_nowait((city, now))
+                self.enqueued += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def _take(self, limit: int) -> list:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            await run_in_threadpool(self.write, batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failures += 1
+            self.dropped += len(batch)
+            logger.error(f"History flush of {len(batch)} events failed: {e!r}")
+
+    async def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    batch += self._take(self.batch_size - len(batch))
+                    remaining = deadline - time.monotonic()
+                    if len(batch) >= self.batch_size or remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            finally:
+                # Runs even when cancelled mid-batch; stop() waits for it
+                if batch:
+                    self._inflight = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._inflight)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize() if self._queue else 0, "queue_size": self.queue_size,
+                "enqueued": self.enqueued, "written": self.written, "dropped": self.dropped,
+                "batches": self.batches, "failures": self.failures}
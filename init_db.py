@@ -1,18 +1,6 @@
+from database import engine
+from main import Base  # importing main registers every model on Base
 
-import sqlite3
+Base.metadata.create_all(bind=engine)
 
-conn = sqlite3.connect("weather.db")
-cursor = conn.cursor()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS subscriptions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    endpoint TEXT NOT NULL,
-    keys TEXT NOT NULL
-)
-""")
-
-conn.commit()
-conn.close()
-
-print("Database initialized with subscriptions table.")
+print(f"Database initialized: {', '.join(sorted(Base.metadata.tables))}")
@@ -1,32 +1,26 @@
-import sqlite3
-
-# Connect to your database
-conn = sqlite3.connect("weather.db")
-cursor = conn.cursor()
+from sqlalchemy import inspect, text
+from database import engine
 
 # Show all tables
 print("Tables in the database:")
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-print(cursor.fetchall())
-
-# Example: show data from users table
-try:
-    cursor.execute("SELECT * FROM users;")
-    rows = cursor.fetchall()
-    print("\nUsers table:")
-    for row in rows:
-        print(row)
-except Exception as e:
-    print("\nNo 'users' table or error:", e)
+print(inspect(engine).get_table_names())
 
-# Example: show data from searches table
-try:
-    cursor.execute("SELECT * FROM searches;")
-    rows = cursor.fetchall()
-    print("\nSearches table:")
-    for row in rows:
-        print(row)
-except Exception as e:
-    print("\nNo 'searches' table or error:", e)
+with engine.connect() as conn:
+    # Example: show data from users table
+    try:
+        rows = conn.execute(text("SELECT * FROM users")).fetchall()
+        print("\nUsers table:")
+        for row in rows:
+            print(tuple(row))
+    except Exception as e:
+        print("\nNo 'users' table or error:", e)
+        conn.rollback()
 
-conn.close()
+    # Example: show data from searches table
+    try:
+        rows = conn.execute(text("SELECT * FROM searches")).fetchall()
+        print("\nSearches table:")
+        for row in rows:
+            print(tuple(row))
+    except Exception as e:
+        print("\nNo 'searches' table or error:", e)
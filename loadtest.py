@@ -0,0 +1,312 @@
+"""
+Load generator for the weather API.
+
+Drives many concurrent virtual users through the same calls weather_helper.py
+makes (login, weather, forecast, plus batch weather), with Zipf
+city popularity, think times and a ramp profile, then reports throughput and
+latency percentiles per endpoint.
+
+    python loadtest.py --users 2000 --duration 120 --ramp 0:0,30:2000 --zipf 1.1
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import bisect
+from collections import defaultdict
+
+import httpx
+
+from weather_helper import BASE_URL
+
+DEFAULT_CITIES = ["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "London", "Paris", "New York", "Tokyo", "Lagos"]
+
+
+# --- Workload Model ---
+class Zipf:
+    """
+    Samples items so the k-th most popular one is picked with weight 1/k^s.
+    """
+    def __init__(self, items: list, s: float, rng: random.Random):
+        self.items = items
+        self.rng = rng
+        total, self.cumulative = 0.0, []
+        for k in range(1, len(items) + 1):
+            total += 1 / k ** s
+            self.cumulative.append(total)
+
+    def sample(self):
+        return self.items[bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+
+def parse_ramp(spec: str, users: int, duration: float) -> list:
+    """
+    "t:users,t:users,..." stages, interpolated linearly. Default ramps up over the first 10%.
+    """
+    if not spec:
+        return [(0.0, 0), (max(1.0, duration * 0.1), users)]
+    stages = []
+    for part in spec.split(","):
+        at, count = part.split(":")
+        stages.append((float(at), int(count)))
+    return sorted(stages)
+
+
+def users_at(stages: list, t: float) -> int:
+    if t <= stages[0][0]:
+        return stages[0][1]
+    for (t0, u0), (t1, u1) in zip(stages, stages[1:]):
+        if t <= t1:
+            return round(u0 + (u1 - u0) * (t - t0) / (t1 - t0)) if t1 > t0 else u1
+    return stages[-1][1]
+
+
+ACTIONS = ("weather", "forecast", "batch")
+
+
+def parse_mix(spec: str) -> list:
+    mix = []
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        if name.strip() not in ACTIONS:
+            raise ValueError(f"Unknown action {name.strip()!r}, expected one of {', '.join(ACTIONS)}")
+        mix.append((name.strip(), float(weight)))
+    return mix
+
+
+# --- Metrics ---
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.started = time.monotonic()
+        self.vus_started = 0
+        self.vus_dead = 0  # gave up logging in
+        self.active = 0    # logged in and issuing requests
+        self.peak_active = 0
+
+    def record(self, endpoint: str, seconds: float, status):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+
+    @staticmethod
+    def percentile(sorted_values: list, q: float) -> float:
+        if not sorted_values:
+            return 0.0
+        return sorted_values[min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1)]
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            ok = sum(n for status, n in self.statuses[endpoint].items() if isinstance(status, int) and status < 400)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "ok": ok,
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(self.percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(self.percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(self.percentile(values, 0.99) * 1000, 2),
+                "p999_ms": round(self.percentile(values, 0.999) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "statuses": {str(k): v for k, v in self.statuses[endpoint].items()},
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total,
+                "rps": round(total / elapsed, 2) if elapsed else 0.0,
+                "users": {"started": self.vus_started, "dead": self.vus_dead, "peak_active": self.peak_active},
+                "endpoints": endpoints}
+
+
+# --- Virtual Users ---
+# Same request shapes as weather_helper.py, made async so one process can run thousands of users
+async def call(client, rec: Recorder, endpoint: str, method: str, url: str, **kwargs):
+    start = time.monotonic()
+    try:
+        res = await client.request(method, url, **kwargs)
+        status = res.status_code
+    except httpx.HTTPError as e:
+        res, status = None, type(e).__name__
+    rec.record(endpoint, time.monotonic() - start, status)
+    return res
+
+
+async def login(client, rec: Recorder, username: str, password: str, retries: int, rng: random.Random):
+    """
+    Logs in, backing off on 503/429 (the server's password pool is full) and network errors.
+    """
+    for attempt in range(retries + 1):
+        res = await call(client, rec, "login", "POST", "/token",
+                         headers={"Content-Type": "application/x-www-form-urlencoded"},
+                         data={"username": username, "password": password})
+        if res is not None and res.status_code == 200:
+            try:
+                return res.json().get("access_token")
+            except ValueError:
+                return None
+        if res is not None and res.status_code not in (429, 503):
+            return None  # bad credentials won't get better
+        retry_after = res.headers.get("Retry-After", "") if res is not None else ""
+        delay = float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt
+        await asyncio.sleep(delay * rng.uniform(0.5, 1.5))
+    return None
+
+
+async def get_token(client, rec: Recorder, args, username: str, token_cache: dict, rng: random.Random):
+    if args.shared_token and username in token_cache:
+        shared = token_cache[username]
+        token = await asyncio.shield(shared)
+        if token is not None or token_cache.get(username) is shared:
+            return token  # the shared login succeeded, or gave up after its retries
+        # The VU logging in was stopped mid-login; try again ourselves
+    pending = asyncio.get_running_loop().create_future()
+    if args.shared_token:
+        token_cache[username] = pending  # later VUs wait for this login instead of starting their own
+    token = None
+    try:
+        token = await login(client, rec, username, args.password, args.login_retries, rng)
+    except BaseException:
+        if token_cache.get(username) is pending:
+            del token_cache[username]
+        raise
+    finally:
+        pending.set_result(token)  # always resolved, so waiting VUs never hang
+    return token
+
+
+async def virtual_user(n: int, client: httpx.AsyncClient, rec: Recorder, args, cities: Zipf,
+                       mix: list, token_cache: dict, stop: asyncio.Event):
+    rng = random.Random(args.seed + n if args.seed else None)
+    username = f"{args.users_prefix}{n}" if args.users_prefix else args.username
+    rec.vus_started += 1
+
+    token = await get_token(client, rec, args, username, token_cache, rng)
+    if token is None:
+        rec.vus_dead += 1
+        return
+    headers = {"Authorization": f"Bearer {token}"}
+    rec.active += 1
+    rec.peak_active = max(rec.peak_active, rec.active)
+    try:
+        await user_loop(client, rec, args, cities, mix, headers, rng, stop)
+    finally:
+        rec.active -= 1
+
+
+async def user_loop(client, rec: Recorder, args, cities: Zipf, mix: list, headers: dict,
+                    rng: random.Random, stop: asyncio.Event):
+    names, weights = zip(*mix)
+    while not stop.is_set():
+        action = rng.choices(names, weights)[0]
+        if action == "weather":
+            await call(client, rec, "weather", "GET", "/weather", params={"city": cities.sample()}, headers=headers)
+        elif action == "forecast":
+            await call(client, rec, "forecast", "GET", "/forecast", params={"city": cities.sample()}, headers=headers)
+        elif action == "batch":
+            await call(client, rec, "batch", "POST", "/weather/batch", headers=headers,
+                       json={"cities": list({cities.sample() for _ in range(args.batch_size)})})
+        if args.think_ms > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), rng.expovariate(1000 / args.think_ms))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed or None)
+    city_names = list(DEFAULT_CITIES)
+    if args.cities and os.path.exists(args.cities):
+        with open(args.cities, encoding="utf-8") as f:
+            city_names = [row["name"] for row in json.load(f)]
+    rng.shuffle(city_names)
+    cities = Zipf(city_names, args.zipf, rng)
+    mix = parse_mix(args.mix)
+    stages = parse_ramp(args.ramp, args.users, args.duration)
+
+    rec = Recorder()
+    token_cache = {}
+    running = []  # (task, stop event)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        started = time.monotonic()
+        while (elapsed := time.monotonic() - started) < args.duration:
+            target = users_at(stages, elapsed)
+            while len(running) < target:
+                stop = asyncio.Event()
+                task = asyncio.ensure_future(virtual_user(len(running), client, rec, args, cities, mix, token_cache, stop))
+                running.append((task, stop))
+            retired = []
+            while len(running) > target:
+                task, stop = running.pop()
+                stop.set()
+                task.cancel()
+                retired.append(task)
+            await asyncio.gather(*retired, return_exceptions=True)
+            if args.verbose:
+                logging_in = sum(not task.done() for task, _ in running) - rec.active
+                print(f"t={elapsed:5.1f}s users={rec.active} logging_in={logging_in} dead={rec.vus_dead} "
+                      f"requests={sum(map(len, rec.latencies.values()))}", file=sys.stderr)
+            await asyncio.sleep(1)
+        for task, stop in running:
+            stop.set()
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in running), return_exceptions=True)
+    return rec.report()
+
+
+def print_report(report: dict):
+    users = report["users"]
+    print(f"\n⏱  {report['elapsed_s']}s, {report['requests']} requests, {report['rps']} req/s")
+    print(f"👥 {users['peak_active']} peak active users, {users['started']} started, {users['dead']} failed to log in")
+    print(f"{'endpoint':<14}{'reqs':>8}{'ok':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'p999':>9}{'max':>9}  (ms)")
+    for name, e in report["endpoints"].items():
+        print(f"{name:<14}{e['requests']:>8}{e['ok']:>8}{e['rps']:>9}{e['p50_ms']:>9}{e['p95_ms']:>9}"
+              f"{e['p99_ms']:>9}{e['p999_ms']:>9}{e['max_ms']:>9}")
+        errors = {k: v for k, v in e["statuses"].items() if not k.isdigit() or int(k) >= 400}
+        if errors:
+            print(f"{'':<14}errors: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the weather API")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", BASE_URL))
+    parser.add_argument("--users", type=int, default=100, help="peak virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--ramp", default="", help='stages as "t:users,...", e.g. "0:0,30:1000,90:1000"')
+    parser.add_argument("--think-ms", type=float, default=1000, help="mean think time between calls")
+    parser.add_argument("--zipf", type=float, default=1.0, help="city popularity skew (0 = uniform)")
+    parser.add_argument("--cities", default=os.path.join("data", "cities.json"), help="city list (city.list.json format)")
+    parser.add_argument("--mix", default="weather=70,forecast=20,batch=10",
+                        help=f"action weights, from {', '.join(ACTIONS)}")
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--username", default="user@example.com")
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--users-prefix", default="", help="log each VU in as <prefix><n> instead of one shared user")
+    parser.add_argument("--shared-token", action=argparse.BooleanOptionalAction, default=True,
+                        help="reuse one token per username; --no-shared-token logs every VU in (bcrypt-heavy)")
+    parser.add_argument("--login-retries", type=int, default=5, help="retries with backoff when the server is busy")
+    parser.add_argument("--connections", type=int, default=1000, help="client connection pool size")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
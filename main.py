@@ -1,21 +1,39 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
-from passlib.context import CryptContext
+from sqlalchemy import insert, inspect, select, text, update, Boolean, Column, Integer, String, DateTime, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Protocol
+from collections import Counter
 from pydantic import BaseModel, constr
-import requests
 import os
+import re
 import json
-import sqlite3
+import time
+import uuid
+import asyncio
+import socket
+import hashlib
 import logging
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+import upstream
+from database import Base, SessionLocal, engine, AsyncSessionLocal, async_engine, get_async_db
+from upstream import SingleFlight, UpstreamError
+from password_pool import PasswordPool, PasswordPoolBusy, get_context
+from weather_cache import TTLCache, make_cache_backend, normalize_city
+from prefetch import PrefetchScheduler
+from geo import CityIndex, CoordinateGrid
+from sessions import RevocationList
+from history import HistoryWriter
+from sketches import HyperLogLog, SketchExchange, SpaceSaving, WindowedSketch
+from retention import purge_table, reclaim_space
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO)
@@ -24,14 +42,111 @@ logger = logging.getLogger(__name__)
 # --- Settings ---
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecret")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))  # short-lived; renewed with the refresh token
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+REFRESH_REUSE_GRACE_SECONDS = float(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "30"))  # a just-rotated refresh token still works this long
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "30"))  # how often to pick up other workers' revocations
+# "stateless": tokens carry user id + token version, checked against an in-memory user cache.
+# "db": look the user up on every request.
+AUTH_MODE = os.getenv("AUTH_MODE", "stateless")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # also bounds how long other workers accept revoked tokens
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))  # verified tokens kept, ~1KB each; 0 disables
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "f2d2bc9d7addb7162b99e7c22c90679a")
-DB_PATH = "weather.db"
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))  # seconds
+# Past the TTL an entry is served stale while it refreshes, up to the hard TTL. Set equal to the TTL to disable.
+WEATHER_CACHE_HARD_TTL = float(os.getenv("WEATHER_CACHE_HARD_TTL", "1800"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1024"))
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "1800"))
+FORECAST_CACHE_HARD_TTL = float(os.getenv("FORECAST_CACHE_HARD_TTL", "10800"))
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "512"))
+# Shared tier behind the in-memory caches: disk (per host), redis (per cluster), memory or none
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "disk")
+DISK_CACHE_PATH = os.getenv("DISK_CACHE_PATH", "weather_cache.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# With a shared tier, memory is only a near-cache: entries are re-read from the shared tier after this long
+NEAR_CACHE_TTL = float(os.getenv("NEAR_CACHE_TTL", "15"))  # seconds
+WEATHER_BATCH_MAX = int(os.getenv("WEATHER_BATCH_MAX", "50"))
+OPENWEATHER_GROUP_LIMIT = 20  # max ids per /group call
+# Coordinates are snapped to ~COORD_CELL_KM cells (0 disables), or to geohash cells if a precision is set
+COORD_CELL_KM = float(os.getenv("COORD_CELL_KM", "1.0"))
+COORD_GEOHASH_PRECISION = int(os.getenv("COORD_GEOHASH_PRECISION", "0")) or None
+# Local city list (OpenWeather city.list.json format) for reverse-geocoding coordinates
+CITY_DATASET_PATH = os.getenv("CITY_DATASET_PATH", os.path.join("data", "cities.json"))
+CITY_MATCH_MAX_KM = float(os.getenv("CITY_MATCH_MAX_KM", "20"))
+# Search history is queued and written in batches off the request path; "0" writes it inside each request
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "1") == "1"
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))  # events beyond this are dropped
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))  # seconds
+# Raw history older than this is rolled up, archived and deleted
+SEARCH_RETENTION_DAYS = int(os.getenv("SEARCH_RETENTION_DAYS", "30"))
+LOGIN_RETENTION_DAYS = int(os.getenv("LOGIN_RETENTION_DAYS", "90"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))  # 0 disables the job
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "2000"))  # rows per delete transaction
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "archive")  # Parquet exports; empty disables
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))  # SQLite pages freed per step
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "20"))
+PREFETCH_WINDOW_HOURS = float(os.getenv("PREFETCH_WINDOW_HOURS", "24"))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "60"))  # seconds between cycles
+PREFETCH_CALLS_PER_MINUTE = float(os.getenv("PREFETCH_CALLS_PER_MINUTE", "30"))  # 0 disables prefetch
+STATS_MAX_WINDOW_DAYS = int(os.getenv("STATS_MAX_WINDOW_DAYS", "366"))  # longest window /stats endpoints accept
+# Approximate real-time popularity: top cities over the last hour, distinct searchers over the last day
+LIVE_STATS_ENABLED = os.getenv("LIVE_STATS_ENABLED", "1") == "1"
+LIVE_TOPK_CAPACITY = int(os.getenv("LIVE_TOPK_CAPACITY", "200"))  # cities tracked per minute slice
+LIVE_HLL_PRECISION = int(os.getenv("LIVE_HLL_PRECISION", "12"))   # 4KB per hour slice, ~1.6% error
+LIVE_PUBLISH_INTERVAL = float(os.getenv("LIVE_PUBLISH_INTERVAL", "10"))  # seconds between sharing with other workers
+SKETCH_CACHE_PATH = os.getenv("SKETCH_CACHE_PATH", "weather_sketches.db")  # with CACHE_BACKEND=disk
 
 # --- FastAPI App ---
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def startup():
+    await upstream.start_client()
+    password_pool.start()
+    await run_in_threadpool(load_city_ids)
+    await run_in_threadpool(load_city_index)
+    await run_in_threadpool(backfill_rollups)
+    await load_revocations()
+    revocation_sync["task"] = asyncio.create_task(revocation_sync_loop())
+    if RETENTION_INTERVAL_HOURS > 0:
+        retention["task"] = asyncio.create_task(retention_loop())
+    if HISTORY_WRITE_BEHIND:
+        history_writer.start()
+    if LIVE_STATS_ENABLED:
+        sketch_exchange.start()
+    if PREFETCH_ENABLED:
+        prefetcher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await prefetcher.stop()
+    await sketch_exchange.stop()
+    if revocation_sync["task"] is not None:
+        revocation_sync["task"].cancel()
+    if retention["task"] is not None:
+        retention["task"].cancel()
+    await history_writer.stop()
+    await upstream.close_client()
+    password_pool.shutdown()
+    await async_engine.dispose()
+
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+
+
+@app.exception_handler(PasswordPoolBusy)
+async def password_pool_busy_handler(request: Request, exc: PasswordPoolBusy):
+    logger.warning("Password pool saturated, rejecting request")
+    return JSONResponse({"detail": "Server busy, please retry"}, status_code=503, headers={"Retry-After": "1"})
+
+
 # Serve static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -66,55 +181,151 @@ app.add_middleware(
 )
 
 # --- Database Setup ---
-DATABASE_URL = f"sqlite:///{DB_PATH}"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
+# Engine, sessions and SQLite tuning live in database.py
 class SearchHistory(Base):
     __tablename__ = "search_history"
     id = Column(Integer, primary_key=True, index=True)
     city = Column(String, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+class SearchRollup(Base):
+    """
+    Searches per city per hour, kept up to date alongside search_history so
+    popularity queries don't have to scan the raw table.
+    """
+    __tablename__ = "search_rollup"
+    city = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True, index=True)  # start of the hour, UTC
+    searches = Column(Integer, nullable=False, default=0)
+
+class LoginHistory(Base):
+    __tablename__ = "login_history"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, index=True)
+    login_time = Column(DateTime)
+
+class LoginRollup(Base):
+    """
+    Logins per user per day, for history that has aged out of login_history.
+    """
+    __tablename__ = "login_rollup"
+    username = Column(String, primary_key=True)
+    day = Column(DateTime, primary_key=True, index=True)  # midnight, UTC
+    logins = Column(Integer, nullable=False, default=0)
+
+class CityId(Base):
+    __tablename__ = "city_ids"
+    city = Column(String, primary_key=True)  # normalized name
+    owm_id = Column(Integer, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     last_login = Column(DateTime)
+    token_version = Column(Integer, default=0, nullable=False, server_default="0")
+
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+    id = Column(Integer, primary_key=True)
+    endpoint = Column(String, nullable=False)
+    keys = Column(String, nullable=False)
+
+class UserSession(Base):
+    """
+    One row per refresh token. Access tokens point at their session through the "sid" claim.
+    """
+    __tablename__ = "user_sessions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    jti = Column(String, unique=True, index=True)
+    issued_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime)
+    revoked = Column(Boolean, default=False, nullable=False)
+    revoked_at = Column(DateTime, index=True)
+    revoked_reason = Column(String)  # rotated, logout, reset or reuse
+    replaced_by = Column(String)     # jti of the session a rotation created
+    client_info = Column(String)
+
+# Columns added after their table first shipped: create_all doesn't add columns to existing tables
+ADDED_COLUMNS = {
+    "users": {"token_version": "INTEGER NOT NULL DEFAULT 0"},
+    "user_sessions": {"revoked_at": "TIMESTAMP", "revoked_reason": "VARCHAR", "replaced_by": "VARCHAR"},
+}
 
-Base.metadata.create_all(bind=engine)
+def migrate_schema(engine):
+    Base.metadata.create_all(bind=engine)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {col["name"] for col in inspect(engine).get_columns(table)}
+        for column, ddl in columns.items():
+            if column not in existing:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                logger.info(f"Added '{column}' column to {table} table")
+    # Indexes on added columns, which create_all skipped along with the column
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing and index.columns.keys()[0] in ADDED_COLUMNS.get(table.name, {}):
+                index.create(bind=engine)
+                logger.info(f"Created index {index.name}")
+
+migrate_schema(engine)
 
 # --- Auth Utilities ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = get_context()
+password_pool = PasswordPool()
+
+class CachedUser(NamedTuple):
+    id: int
+    username: str
+    token_version: int
+
+class AuthUser(Protocol):
+    """
+    What get_current_user returns: a User row, or a CachedUser in stateless mode.
+    """
+    @property
+    def id(self) -> int: ...
+    @property
+    def username(self) -> str: ...
+    @property
+    def token_version(self) -> int: ...
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Verified claims by token digest. The TTL is only an upper bound; each entry is also checked against its own exp.
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def verify_password(plain, hashed):
+    return await password_pool.verify(plain[:72], hashed)
 
-def verify_password(plain, hashed):
-    return pwd_context.verify(plain[:72], hashed)
+async def hash_password(plain):
+    return await password_pool.hash(plain[:72])  # bcrypt limit
 
-def get_user(db, username: str):
+async def get_user(db: AsyncSession, username: str):
     logger.info(f"Searching user: {username}")
-    return db.query(User).filter(User.username == username).first()
+    return (await db.execute(select(User).where(User.username == username))).scalars().first()
 
-def authenticate_user(db, username: str, password: str):
-    user = get_user(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user:
         logger.warning("User not found")
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         logger.warning("Incorrect password")
         return None
     logger.info(f"User authenticated: {username}")
     return user
 
+async def save_user(db: AsyncSession, user: User):
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -123,21 +334,182 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     logger.info(f"Token created for: {data.get('sub')}")
     return token
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_token(token: str) -> dict:
+    """
+    jwt.decode with a cache of already-verified tokens, so repeat requests skip the signature check.
+    """
+    if TOKEN_CACHE_SIZE <= 0:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return payload
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if "exp" in payload:
+        token_cache.set(digest, payload)
+    return payload
+
+async def get_current_user(token: str = Depends(oauth2_scheme),
+                           db: AsyncSession = Depends(get_async_db)) -> AuthUser:
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username = payload.get("sub")
-        if not username:
+        if not username or payload.get("typ") == "refresh":
             raise credentials_exception
     except JWTError as e:
         logger.error(f"JWT error: {str(e)}")
         raise credentials_exception
-    user = get_user(db, username)
+    if "sid" in payload and revocations.is_revoked(payload["sid"]):
+        raise credentials_exception
+    if AUTH_MODE == "stateless" and "uid" in payload and "ver" in payload:
+        user = await get_cached_user(db, payload["uid"])
+        if not user or user.token_version != payload["ver"]:
+            raise credentials_exception
+        return user
+    user = await get_user(db, username)
     if not user:
         raise credentials_exception
     return user
 
+async def get_cached_user(db: AsyncSession, user_id: int) -> Optional[CachedUser]:
+    user = user_cache.get(user_id)
+    if user is None:
+        row = await db.get(User, user_id)
+        if row is None:
+            return None
+        user = CachedUser(row.id, row.username, row.token_version or 0)
+        user_cache.set(user_id, user)
+    return user
+
+# --- Sessions ---
+revocations = RevocationList()
+revocation_sync = {"task": None, "since": None}  # since = newest revoked_at already loaded
+
+def _unix(dt: datetime) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+def new_session(user_id: int, client_info: str = "") -> UserSession:
+    now = datetime.utcnow()
+    return UserSession(user_id=user_id, jti=uuid.uuid4().hex, issued_at=now,
+                       expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS), client_info=client_info[:200])
+
+async def issue_tokens(db: AsyncSession, user: User, client_info: str = "") -> dict:
+    """
+    Opens a session and returns a fresh access/refresh token pair for it.
+    """
+    session = new_session(user.id, client_info)
+    db.add(session)
+    await db.commit()
+    return session_tokens(user, session)
+
+def session_tokens(user: User, session: UserSession) -> dict:
+    claims = {"sub": user.username, "uid": user.id, "ver": user.token_version or 0}
+    access_token = create_access_token(data={**claims, "sid": session.jti})
+    refresh_token = create_access_token(data={**claims, "jti": session.jti, "typ": "refresh"},
+                                        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer",
+            "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60}
+
+async def revoke_sessions(db: AsyncSession, sessions: list, reason: str):
+    now = datetime.utcnow()
+    for session in sessions:
+        session.revoked, session.revoked_at, session.revoked_reason = True, now, reason
+    await db.commit()
+    revocations.add_many((session.jti, _unix(session.expires_at)) for session in sessions)
+
+async def revoke_user_sessions(db: AsyncSession, user_id: int, reason: str):
+    active = (await db.execute(select(UserSession).where(
+        UserSession.user_id == user_id, UserSession.revoked == False,
+        UserSession.expires_at > datetime.utcnow()))).scalars().all()
+    await revoke_sessions(db, active, reason)
+    logger.info(f"Revoked {len(active)} sessions for user {user_id} ({reason})")
+
+async def rotate_refresh_token(db: AsyncSession, refresh_token: str, client_info: str = "") -> dict:
+    """
+    Swaps a refresh token for a new pair, revoking the old session. Within
+    REFRESH_REUSE_GRACE_SECONDS of its rotation the old token gets the new
+    session's pair again (concurrent refreshes, e.g. two tabs). Presenting it
+    after that ends every session of that user, since it has probably leaked;
+    a token whose session ended by logout or reset is simply rejected.
+    """
+    credentials_exception = HTTPException(status_code=401, detail="Invalid refresh token")
+    try:
+        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        logger.error(f"JWT error: {str(e)}")
+        raise credentials_exception
+    if payload.get("typ") != "refresh" or "jti" not in payload:
+        raise credentials_exception
+    session = await get_session(db, payload["jti"])
+    if session is None:
+        raise credentials_exception
+    user = await db.get(User, session.user_id)
+    if user is None or (user.token_version or 0) != payload.get("ver"):
+        raise credentials_exception
+
+    # Compare-and-swap on revoked: of several concurrent refreshes of one token, exactly one rotates it
+    now = datetime.utcnow()
+    successor = new_session(user.id, client_info)
+    result = await db.execute(
+        update(UserSession).where(UserSession.id == session.id, UserSession.revoked == False)
+        .values(revoked=True, revoked_at=now, revoked_reason="rotated", replaced_by=successor.jti))
+    if result.rowcount == 1:
+        db.add(successor)
+        await db.commit()
+        revocations.add(session.jti, _unix(session.expires_at))
+        return session_tokens(user, successor)
+
+    await db.rollback()
+    await db.refresh(session)
+    await db.refresh(user)
+    if session.revoked_reason != "rotated":
+        raise credentials_exception
+    if session.revoked_at is not None and (now - session.revoked_at).total_seconds() <= REFRESH_REUSE_GRACE_SECONDS:
+        current = await get_session(db, session.replaced_by)
+        if current is not None and not current.revoked:
+            return session_tokens(user, current)
+    logger.warning(f"Reused refresh token for user {user.id}, revoking all sessions")
+    await revoke_user_sessions(db, user.id, "reuse")
+    raise credentials_exception
+
+async def get_session(db: AsyncSession, jti: str) -> Optional[UserSession]:
+    return (await db.execute(select(UserSession).where(UserSession.jti == jti))).scalars().first()
+
+async def load_revocations():
+    """
+    Rebuilds the in-memory revocation list from every revoked, unexpired session.
+    """
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(UserSession.jti, UserSession.expires_at, UserSession.revoked_at).where(
+            UserSession.revoked == True, UserSession.expires_at > datetime.utcnow()))).all()
+    revocations.load((jti, _unix(expires_at)) for jti, expires_at, _ in rows)
+    revocation_sync["since"] = max((r.revoked_at for r in rows if r.revoked_at), default=datetime.utcnow())
+    logger.info(f"Loaded {len(revocations)} revoked sessions")
+
+async def sync_revocations():
+    """
+    Picks up sessions revoked since the last sync, e.g. by other workers.
+    revoked_at is stamped before its commit, so a revocation can become visible
+    after a later-stamped one; re-reading one sync interval back catches it.
+    """
+    since = revocation_sync["since"] - timedelta(seconds=REVOCATION_SYNC_SECONDS)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(UserSession.jti, UserSession.expires_at, UserSession.revoked_at).where(
+            UserSession.revoked_at > since))).all()
+    if rows:
+        revocations.add_many((jti, _unix(expires_at)) for jti, expires_at, _ in rows)
+        revocation_sync["since"] = max(revocation_sync["since"], *(r.revoked_at for r in rows))
+    revocations.synced_at = time.time()
+
+async def revocation_sync_loop():
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+        try:
+            await sync_revocations()
+        except Exception as e:
+            logger.error(f"Revocation sync failed: {e}")
+
 # --- Schemas ---
 class RegisterUser(BaseModel):
     username: constr(strip_whitespace=True, min_length=4, max_length=50)
@@ -147,12 +519,23 @@ class ForgotPasswordRequest(BaseModel):
     username: constr(strip_whitespace=True, min_length=1)
     new_password: constr(min_length=6, max_length=100)
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class Coords(BaseModel):
+    lat: float
+    lon: float
+
+class BatchWeatherRequest(BaseModel):
+    cities: List[constr(strip_whitespace=True, min_length=1)] = []
+    coords: List[Coords] = []
+
 # --- Initial Demo User ---
 def create_demo_user():
     db = SessionLocal()
     username = "user@example.com"
     password = "password123"
-    if not get_user(db, username):
+    if not db.query(User).filter(User.username == username).first():
         hashed_password = pwd_context.hash(password[:72])  # bcrypt limit
         db.add(User(username=username, hashed_password=hashed_password))
         db.commit()
@@ -164,91 +547,702 @@ if os.getenv("CREATE_DEMO_USER", "1") == "1":
 
 # --- Routes ---
 @app.post("/register")
-def register(user: RegisterUser, db: Session = Depends(get_db)):
-    if get_user(db, user.username):
+async def register(user: RegisterUser, db: AsyncSession = Depends(get_async_db)):
+    if await get_user(db, user.username):
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_password = pwd_context.hash(user.password[:72])  # bcrypt limit
+    hashed_password = await hash_password(user.password)
     new_user = User(username=user.username, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await save_user(db, new_user)
     logger.info(f"New user registered: {user.username}")
     return {"message": "User registered successfully"}
 
 @app.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(),
+                db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
 
     user.last_login = datetime.utcnow()
-    db.commit()
+    await save_user(db, user)
 
     logger.info(f"User logged in: {user.username} at {user.last_login}")
-    access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer", "last_login": str(user.last_login)}
+    tokens = await issue_tokens(db, user, request.headers.get("user-agent", ""))
+    return {**tokens, "last_login": str(user.last_login)}
+
+@app.post("/token/refresh")
+async def refresh_token(req: RefreshRequest, request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await rotate_refresh_token(db, req.refresh_token, request.headers.get("user-agent", ""))
+
+@app.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db),
+                 user: AuthUser = Depends(get_current_user)):
+    sid = decode_token(token).get("sid")
+    if sid:
+        session = await get_session(db, sid)
+        if session is not None and not session.revoked:
+            await revoke_sessions(db, [session], "logout")
+    logger.info(f"User logged out: {user.username}")
+    return {"message": "Logged out"}
 
 @app.post("/forgot-password")
-def forgot_password(req: ForgotPasswordRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == req.username).first()
+async def forgot_password(req: ForgotPasswordRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user(db, req.username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user.hashed_password = pwd_context.hash(req.new_password[:72]) # bcrypt limit
-    db.commit()
+    user.hashed_password = await hash_password(req.new_password)
+    # Bumping the version invalidates every token issued before the reset
+    user.token_version = (user.token_version or 0) + 1
+    await save_user(db, user)
+    user_cache.invalidate(user.id)
+    await revoke_user_sessions(db, user.id, "reset")
     logger.info(f"Password reset for user: {req.username}")
     return {"message": "Password reset successful"}
 
+# --- Weather Cache ---
+weather_cache = TTLCache(maxsize=WEATHER_CACHE_SIZE, ttl=WEATHER_CACHE_TTL, hard_ttl=WEATHER_CACHE_HARD_TTL)
+forecast_cache = TTLCache(maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL, hard_ttl=FORECAST_CACHE_HARD_TTL)
+shared_cache = make_cache_backend(CACHE_BACKEND, max_age=max(WEATHER_CACHE_HARD_TTL, FORECAST_CACHE_HARD_TTL),
+                                  disk_path=DISK_CACHE_PATH, redis_url=REDIS_URL)
+upstream_flights = SingleFlight()
+coord_grid = CoordinateGrid(cell_km=COORD_CELL_KM, geohash_precision=COORD_GEOHASH_PRECISION)
+
+def weather_cache_key(params: dict):
+    if "id" in params:
+        # Names repeat across countries (London GB/CA), so a coordinate match is keyed by its id
+        return ("weather", "id", params["id"])
+    if "q" in params:
+        return ("weather", "city", normalize_city(params["q"]))
+    return ("weather", "cell", coord_grid.snap(params["lat"], params["lon"]).key)
+
+def log_refresh_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Background refresh failed, keeping stale entry: {task.exception()!r}")
+
+async def cache_store(cache: TTLCache, key, value):
+    cache.set(key, value)
+    if shared_cache is not None:
+        try:
+            await run_in_threadpool(shared_cache.set, key, value)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {key}: {e!r}")
+
+def promote_from_shared(cache: TTLCache, key, entry: tuple):
+    # Copies a shared-tier entry into memory with its real age; returns (value, fresh) or None if too old
+    value, age = entry
+    held = cache.touch(key)
+    if held is not None and held[1] <= age:
+        value, age = held  # memory already has this copy or a newer one
+    elif age >= cache.hard_ttl:
+        return None
+    else:
+        cache.set(key, value, age=age)
+    return value, age < cache.ttl
+
+def near_expired(cache: TTLCache, key) -> bool:
+    # Memory misses, and memory entries held past the near-cache window, are read from the shared tier
+    if shared_cache is None:
+        return False
+    held = cache.held_for(key)
+    return held is None or held >= NEAR_CACHE_TTL
+
+async def shared_lookup_many(cache: TTLCache, keys: list) -> dict:
+    if shared_cache is None or not keys:
+        return {}
+    try:
+        entries = await run_in_threadpool(shared_cache.get_many, keys)
+    except Exception as e:
+        logger.warning(f"Shared cache read failed: {e!r}")
+        return {}
+    hits = {key: promote_from_shared(cache, key, entry) for key, entry in entries.items()}
+    for key in keys:
+        if key not in entries:
+            cache.touch(key)  # nothing newer shared; check again after another window
+    return {key: hit for key, hit in hits.items() if hit is not None}
+
+async def shared_lookup(cache: TTLCache, key):
+    return (await shared_lookup_many(cache, [key])).get(key)
+
+def revalidator(cache: TTLCache, key, load):
+    # Another worker or node may already have refreshed the shared tier
+    async def revalidate():
+        hit = await shared_lookup(cache, key)
+        if hit is not None and hit[1]:
+            return hit[0]
+        return await load()
+
+    return revalidate
+
+async def cached_fetch(cache: TTLCache, key, load):
+    # Memory, then the shared tier, then upstream.
+    # Fresh hits return directly; stale hits return directly and refresh in the background
+    hit = cache.lookup(key)
+    if hit is None or near_expired(cache, key):
+        hit = await shared_lookup(cache, key) or hit
+    if hit is not None:
+        value, fresh = hit
+        if not fresh:
+            upstream_flights.start(key, revalidator(cache, key, load)).add_done_callback(log_refresh_failure)
+        return value
+    return await upstream_flights.do(key, load)
+
+def weather_loader(params: dict):
+    key = weather_cache_key(params)
+    if "q" not in params:
+        # Fetch the cell centre so the cached result is the same for everyone in the cell
+        cell = coord_grid.snap(params["lat"], params["lon"])
+        params = {"lat": cell.lat, "lon": cell.lon}
+    # A known id is exact and skips upstream geocoding
+    query = {"id": params["id"]} if "id" in params else params
+
+    async def load():
+        _, data = await upstream.fetch_json("/weather", {**query, "appid": OPENWEATHER_API_KEY, "units": "metric"})
+        if data.get("cod") == 200:
+            if "q" not in params:
+                data["cell"] = key[2]
+            await cache_store(weather_cache, key, data)
+            # A coordinate match may be a namesake of the city users mean by that name
+            if "q" in params and "id" not in params and data.get("id"):
+                await remember_city_id(params["q"], data["id"])
+        return data
+
+    return key, load
+
+# --- OpenWeather City IDs ---
+# Learned from single-city responses so misses can later be fetched in bulk via /group
+city_ids = {}
+
+def load_city_ids():
+    db = SessionLocal()
+    try:
+        city_ids.update({row.city: row.owm_id for row in db.query(CityId).all()})
+        logger.info(f"Loaded {len(city_ids)} OpenWeather city ids")
+    finally:
+        db.close()
+
+def save_city_id(city: str, owm_id: int):
+    db = SessionLocal()
+    try:
+        db.merge(CityId(city=city, owm_id=owm_id, updated_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+# --- Nearest City Index ---
+city_index: Optional[CityIndex] = None
+
+def load_city_index():
+    global city_index
+    if not os.path.exists(CITY_DATASET_PATH):
+        logger.warning(f"City dataset {CITY_DATASET_PATH} not found, coordinates won't be matched to cities")
+        return
+    city_index = CityIndex.from_file(CITY_DATASET_PATH)
+    # Unambiguous names can go straight to /group without a first single lookup
+    names = {}
+    for c in city_index.cities:
+        names.setdefault(normalize_city(c.name), []).append(c.id)
+    for name, ids in names.items():
+        if len(ids) == 1:
+            city_ids.setdefault(name, ids[0])
+
+def coords_query(lat: float, lon: float) -> dict:
+    """
+    Query params for a coordinate lookup: the nearest known city if it is
+    within CITY_MATCH_MAX_KM, else the raw coordinates.
+    """
+    if city_index is not None:
+        match = city_index.nearest(lat, lon)
+        if match is not None and match[1] <= CITY_MATCH_MAX_KM:
+            return {"q": match[0].name, "id": match[0].id}
+    return {"lat": lat, "lon": lon}
+
+async def remember_city_id(city: str, owm_id: int):
+    city = normalize_city(city)
+    if city_ids.get(city) != owm_id:
+        city_ids[city] = owm_id
+        await run_in_threadpool(save_city_id, city, owm_id)
+
+def group_loader(cities: List[str]):
+    ids = sorted({city_ids[normalize_city(city)] for city in cities})
+    key = ("weather-group", tuple(ids))
+
+    async def load():
+        status_code, payload = await upstream.fetch_json("/group", {"id": ",".join(map(str, ids)),
+                                                                    "appid": OPENWEATHER_API_KEY, "units": "metric"})
+        if status_code != 200:
+            logger.error(f"Group weather API error: {payload}")
+            raise UpstreamError(502, payload.get("message", "Weather service unavailable"))
+        # Group items carry no "cod"; tag them so they look like /weather responses
+        by_id = {item["id"]: {**item, "cod": 200} for item in payload.get("list", [])}
+        results = {}
+        for city in cities:
+            data = by_id.get(city_ids[normalize_city(city)])
+            if data is not None:
+                await cache_store(weather_cache, weather_cache_key({"q": city}), data)
+                results[normalize_city(city)] = data
+        return results
+
+    return key, load
+
+def start_group_fetch(cities: List[str]) -> dict:
+    """
+    Fetches cities with known ids in one /group call, registering a per-city
+    flight for each so concurrent single lookups share the result.
+    """
+    group = upstream_flights.start(*group_loader(cities))
+    tasks = {}
+    for city in cities:
+        key, load = weather_loader({"q": city})
+
+        async def member(group=group, city=city, load=load):
+            data = (await asyncio.shield(group)).get(normalize_city(city))
+            # Fall back to a single fetch if the id went stale upstream
+            return data if data is not None else await load()
+
+        tasks[city] = upstream_flights.start(key, member)
+    return tasks
+
+def forecast_loader(city: str):
+    key = ("forecast", normalize_city(city))
+
+    async def load():
+        result = await upstream.fetch_json("/forecast", {"q": city, "appid": OPENWEATHER_API_KEY, "units": "metric"})
+        if result[0] == 200:
+            await cache_store(forecast_cache, key, result)
+        return result
+
+    return key, load
+
+async def fetch_current_weather(params: dict) -> dict:
+    key, load = weather_loader(params)
+    return await cached_fetch(weather_cache, key, load)
+
+async def fetch_forecast(city: str):
+    key, load = forecast_loader(city)
+    return await cached_fetch(forecast_cache, key, load)
+
+async def fetch_weather_many(cities: List[str]) -> list:
+    """
+    fetch_current_weather for several cities. Misses with a known id are fetched
+    in /group calls; the exception is returned in place of a failed city.
+    """
+    keys = {weather_cache_key({"q": city}) for city in cities}
+    # One multi-get against the shared tier for everything memory lacks or has held past the near-cache window
+    await shared_lookup_many(weather_cache, [key for key in keys if near_expired(weather_cache, key)])
+
+    results, to_group = {}, []
+    for city in cities:
+        key, load = weather_loader({"q": city})
+        if key in results:
+            continue
+        hit = weather_cache.lookup(key)
+        if hit is not None:
+            results[key] = hit[0]
+            if hit[1]:
+                continue
+        if normalize_city(city) in city_ids:
+            to_group.append(city)
+        elif hit is None:
+            results[key] = upstream_flights.start(key, load)
+        else:
+            upstream_flights.start(key, revalidator(weather_cache, key, load)).add_done_callback(log_refresh_failure)
+
+    for i in range(0, len(to_group), OPENWEATHER_GROUP_LIMIT):
+        for city, task in start_group_fetch(to_group[i:i + OPENWEATHER_GROUP_LIMIT]).items():
+            key = weather_cache_key({"q": city})
+            if key in results:
+                task.add_done_callback(log_refresh_failure)  # stale entry, refreshing in background
+            else:
+                results[key] = task
+
+    for key, value in results.items():
+        if asyncio.isfuture(value):
+            try:
+                results[key] = await asyncio.shield(value)
+            except Exception as e:
+                results[key] = e
+    return [results[weather_cache_key({"q": city})] for city in cities]
+
+# --- Live Popularity ---
+# Sketches are only touched on the event loop; other workers' slices are fetched in the threadpool
+popular = WindowedSketch(SpaceSaving, slice_seconds=60, slices=60, capacity=LIVE_TOPK_CAPACITY)
+searchers = WindowedSketch(HyperLogLog, slice_seconds=3600, slices=24, precision=LIVE_HLL_PRECISION)
+# Own store, since slices must outlive the weather tier's max_age for as long as the 24h window reads them
+sketch_store = make_cache_backend(CACHE_BACKEND, max_age=searchers.span + searchers.slice_seconds,
+                                  disk_path=SKETCH_CACHE_PATH, redis_url=REDIS_URL)
+# The nonce keeps a restarted container (same hostname, often PID 1) from taking its old id,
+# which would hide its earlier slices from itself and overwrite them on the next publish
+sketch_exchange = SketchExchange(sketch_store, {"popular": popular, "searchers": searchers},
+                                 worker_id=f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}",
+                                 interval=LIVE_PUBLISH_INTERVAL)
+
+def track_searches(user_id: int, city_names: List[str]):
+    city_names = [name for name in city_names if is_city_name(name)]
+    if not LIVE_STATS_ENABLED or not city_names:
+        return
+    top = popular.current()
+    for name in city_names:
+        top.add(name)
+    searchers.current().add(str(user_id))
+
+async def live_merged(name: str, seconds: float):
+    remote = await run_in_threadpool(sketch_exchange.remote, name, seconds) if sketch_store is not None else []
+    return sketch_exchange.sketches[name].merged(seconds, remote)
+
+# --- Prefetch ---
+async def prefetch_cities():
+    # Live popularity first; the rollups cover the time after a restart before the sketches fill up
+    # One extra, since rows recorded before unnamed places were skipped may still rank
+    if LIVE_STATS_ENABLED:
+        live = (await live_merged("popular", popular.span)).top(PREFETCH_TOP_N + 1)
+        if live:
+            return [city for city, _, _ in live if is_city_name(city)][:PREFETCH_TOP_N]
+    since = datetime.utcnow() - timedelta(hours=PREFETCH_WINDOW_HOURS)
+    async with AsyncSessionLocal() as db:
+        rows = await top_cities(db, since, PREFETCH_TOP_N + 1)
+    return [city for city, _ in rows if is_city_name(city)][:PREFETCH_TOP_N]
+
+def prefetch_jobs(city: str):
+    yield (weather_cache, *weather_loader({"q": city}))
+    yield (forecast_cache, *forecast_loader(city))
+
+async def prefetch_sync(jobs: list):
+    # Copies newer shared-tier entries into memory, so cities another worker or node refreshed aren't due here
+    by_cache = {}
+    for cache, key, _ in jobs:
+        by_cache.setdefault(cache, []).append(key)
+    for cache, keys in by_cache.items():
+        await shared_lookup_many(cache, keys)
+
+def prefetch_plan(jobs: list) -> list:
+    # Due weather refreshes for cities with a known id share /group calls
+    calls, grouped = [], []
+    for cache, key, load in jobs:
+        if key[:2] == ("weather", "city") and key[2] in city_ids:
+            grouped.append(key[2])
+        else:
+            calls.append((key, load))
+    for i in range(0, len(grouped), OPENWEATHER_GROUP_LIMIT):
+        calls.append(group_loader(grouped[i:i + OPENWEATHER_GROUP_LIMIT]))
+    return calls
+
+prefetcher = PrefetchScheduler(prefetch_cities, prefetch_jobs, upstream_flights, plan=prefetch_plan,
+                               sync=prefetch_sync, interval=PREFETCH_INTERVAL,
+                               calls_per_minute=PREFETCH_CALLS_PER_MINUTE)
+
+# --- Stats ---
+WINDOW_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_window(window: str) -> timedelta:
+    """
+    "90m", "24h", "7d", "2w" or plain seconds, capped at STATS_MAX_WINDOW_DAYS.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([mhdw]?)\s*", window.lower())
+    if not match or float(match.group(1)) <= 0:
+        raise HTTPException(status_code=400, detail="window must look like 90m, 24h, 7d or 2w")
+    seconds = float(match.group(1)) * WINDOW_UNITS.get(match.group(2), 1)
+    # Huge values would overflow timedelta/datetime arithmetic
+    return timedelta(seconds=min(seconds, STATS_MAX_WINDOW_DAYS * 86400))
+
+@app.get("/stats/top-cities")
+async def stats_top_cities(window: str = "24h", limit: int = 10, db: AsyncSession = Depends(get_async_db),
+                           user: AuthUser = Depends(get_current_user)):
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    # Buckets are whole hours, so the window is widened to the start of its first hour
+    since = hour_bucket(datetime.utcnow() - parse_window(window))
+    cities = await top_cities(db, since, limit)
+    return {"window": window, "since": since.isoformat(),
+            "cities": [{"city": city, "searches": searches} for city, searches in cities]}
+
+@app.get("/stats/live")
+async def stats_live(window: str = "5m", users_window: str = "24h", limit: int = 10,
+                     user: AuthUser = Depends(get_current_user)):
+    """
+    Approximate: counts may overestimate by up to max_error, distinct searchers are within a few percent.
+    """
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    top_seconds = min(parse_window(window).total_seconds(), popular.span)
+    users_seconds = min(parse_window(users_window).total_seconds(), searchers.span)
+    top, unique = await asyncio.gather(live_merged("popular", top_seconds), live_merged("searchers", users_seconds))
+    return {
+        "window_seconds": top_seconds,
+        "top_cities": [{"city": city, "searches": count, "max_error": error} for city, count, error in top.top(limit)],
+        "users_window_seconds": users_seconds,
+        "unique_searchers": unique.count(),
+        "workers": max(1, len(sketch_exchange.workers)),
+    }
+
+@app.get("/cache/stats")
+def cache_stats(user: AuthUser = Depends(get_current_user)):
+    return {
+        "weather": weather_cache.stats(),
+        "forecast": forecast_cache.stats(),
+        "shared": shared_cache.stats() if shared_cache is not None else None,
+        "upstream": upstream_flights.stats(),
+        "prefetch": prefetcher.stats(),
+        "password_pool": password_pool.stats(),
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "revocations": revocations.stats(),
+        "history": history_writer.stats(),
+        "live": sketch_exchange.stats(),
+        "retention": {k: v for k, v in retention.items() if k != "task"},
+    }
+
+def weather_summary(data: dict) -> dict:
+    return {
+        "temperature": f"{data.get('main', {}).get('temp', 'N/A')} °C",
+        "condition": data.get("weather")[0].get("description", "N/A").capitalize(),
+        "wind": f"{data.get('wind', {}).get('speed', 'N/A')} m/s",
+        "humidity": f"{data.get('main', {}).get('humidity', 'N/A')}%",
+    }
+
+def weather_error_status(data: dict) -> int:
+    # OpenWeather sends "cod" as a string on errors. Not-found and bad queries are the caller's;
+    # anything else (e.g. a rejected API key) is ours, not a missing city
+    cod = str(data.get("cod"))
+    return int(cod) if cod in ("400", "404") else 502
+
 @app.get("/weather")
-def get_weather(city: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
-                db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_weather(city: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+                      cities: Optional[List[str]] = Query(None),
+                      db: AsyncSession = Depends(get_async_db), user: AuthUser = Depends(get_current_user)):
 
-    logger.info(f"User {user.username} requested weather for {city or lat or lon}")
+    logger.info(f"User {user.username} requested weather for {city or cities or lat or lon}")
+    if cities:
+        # ?cities=a&cities=b is the GET form of /weather/batch; city= keeps "London,GB" as one city
+        return await weather_batch([c.strip() for c in cities if c.strip()], [], db, user.id)
     if city:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
+        params = {"q": city}
     elif lat is not None and lon is not None:
-        url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
+        params = coords_query(lat, lon)
     else:
         city = "Nairobi"
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
+        params = {"q": city}
 
-    res = requests.get(url)
-    data = res.json()
+    data = await fetch_current_weather(params)
 
     if data.get("cod") != 200:
         logger.error(f"Weather API error: {data}")
-        raise HTTPException(status_code=404, detail=data.get("message", "City not found"))
+        raise HTTPException(status_code=weather_error_status(data), detail=data.get("message", "City not found"))
 
-    city_name = city.capitalize() if city else "Nairobi"
-    new_search = SearchHistory(city=city_name)
-    db.add(new_search)
-    db.commit()
+    city_name = city.capitalize() if city else params.get("q") or data.get("name") or UNNAMED_CITY
+    saved_id = (await record_searches(db, [city_name]))[0]
+    track_searches(user.id, [city_name])
 
     return {
         "city": city_name,
-        "temperature": f"{data.get('main', {}).get('temp', 'N/A')} °C",
-        "condition": data.get("weather")[0].get("description", "N/A").capitalize(),
-        "wind": f"{data.get('wind', {}).get('speed', 'N/A')} m/s",
-        "humidity": f"{data.get('main', {}).get('humidity', 'N/A')}%",
-        "saved_id": new_search.id,
+        **weather_summary(data),
+        "saved_id": saved_id,
         "time": datetime.now().strftime("%H:%M:%S"),
 "date": datetime.now().strftime("%Y-%m-%d")
     }
+
+@app.post("/weather/batch")
+async def post_weather_batch(req: BatchWeatherRequest, db: AsyncSession = Depends(get_async_db),
+                             user: AuthUser = Depends(get_current_user)):
+    logger.info(f"User {user.username} requested batch weather for {len(req.cities)} cities, {len(req.coords)} coords")
+    return await weather_batch(req.cities, [(c.lat, c.lon) for c in req.coords], db, user.id)
+
+async def weather_batch(cities: List[str], coords: List[tuple], db: AsyncSession, user_id: int):
+    if not cities and not coords:
+        raise HTTPException(status_code=400, detail="At least one city or coordinate is required")
+    if len(cities) + len(coords) > WEATHER_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {WEATHER_BATCH_MAX} items per batch")
+
+    queries = [{"q": city} for city in cities] + [coords_query(lat, lon) for lat, lon in coords]
+    city_responses, coord_responses = await asyncio.gather(
+        fetch_weather_many(cities),
+        asyncio.gather(*[fetch_current_weather(params) for params in queries[len(cities):]],
+                       return_exceptions=True),
+    )
+    responses = city_responses + list(coord_responses)
+
+    results, found = [], []
+    for i, (params, data) in enumerate(zip(queries, responses)):
+        query = params["q"] if i < len(cities) else dict(zip(("lat", "lon"), coords[i - len(cities)]))
+        if isinstance(data, UpstreamError):
+            results.append({"query": query, "error": data.detail, "status": data.status_code})
+        elif isinstance(data, Exception):
+            # One bad item must not fail the rest of the batch
+            logger.error(f"Batch weather lookup failed for {query}: {data!r}")
+            results.append({"query": query, "error": "Weather service unavailable", "status": 502})
+        elif data.get("cod") != 200:
+            results.append({"query": query, "error": data.get("message", "City not found"),
+                            "status": weather_error_status(data)})
+        else:
+            if i < len(cities):
+                city_name = params["q"].capitalize()
+            else:
+                city_name = params.get("q") or data.get("name") or UNNAMED_CITY
+            found.append(len(results))
+            results.append({"query": query, "city": city_name, **weather_summary(data)})
+
+    # One transaction (or one queue push) for the whole batch's history rows
+    saved_ids = await record_searches(db, [results[i]["city"] for i in found])
+    track_searches(user_id, [results[i]["city"] for i in found])
+    for i, saved_id in zip(found, saved_ids):
+        results[i]["saved_id"] = saved_id
+
+    return {
+        "results": results,
+        "time": datetime.now().strftime("%H:%M:%S"),
+        "date": datetime.now().strftime("%Y-%m-%d")
+    }
+
+# --- Search Rollups ---
+def hour_bucket(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def rollup_rows(events: List[tuple]) -> List[dict]:
+    counts = Counter((city, hour_bucket(ts)) for city, ts in events if city)
+    return [{"city": city, "bucket": bucket, "searches": n} for (city, bucket), n in counts.items()]
+
+def rollup_upsert():
+    """
+    INSERT ... ON CONFLICT that adds to an existing (city, hour) count.
+    """
+    stmt = (sqlite_insert if engine.dialect.name == "sqlite" else pg_insert)(SearchRollup)
+    return stmt.on_conflict_do_update(index_elements=["city", "bucket"],
+                                      set_={"searches": SearchRollup.searches + stmt.excluded.searches})
+
+def backfill_rollups():
+    """
+    Builds the rollups from existing history the first time they're deployed.
+    """
+    db = SessionLocal()
+    try:
+        if db.query(SearchRollup).first() is not None or db.query(SearchHistory).first() is None:
+            return
+        if engine.dialect.name == "sqlite":
+            # Same text format SQLAlchemy stores DateTime values in
+            bucket = func.strftime("%Y-%m-%d %H:00:00.000000", SearchHistory.timestamp)
+        else:
+            bucket = func.date_trunc("hour", SearchHistory.timestamp)
+        db.execute(insert(SearchRollup).from_select(
+            ["city", "bucket", "searches"],
+            select(SearchHistory.city, bucket, func.count()).where(SearchHistory.city.isnot(None))
+            .group_by(SearchHistory.city, bucket)))
+        db.commit()
+        logger.info(f"Backfilled {db.query(SearchRollup).count()} search rollup rows")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Rollup backfill failed: {e}")  # e.g. another worker got there first
+    finally:
+        db.close()
+
+async def top_cities(db: AsyncSession, since: datetime, limit: int) -> List[tuple]:
+    """
+    (city, searches) for the hour buckets from `since` on, most searched first.
+    """
+    total = func.sum(SearchRollup.searches)
+    rows = await db.execute(select(SearchRollup.city, total).where(SearchRollup.bucket >= hour_bucket(since))
+                            .group_by(SearchRollup.city).order_by(total.desc()).limit(limit))
+    return [(city, int(searches)) for city, searches in rows]
+
+# --- Search History ---
+async def save_searches(db: AsyncSession, city_names: List[str]):
+    now = datetime.utcnow()
+    searches = [SearchHistory(city=name, timestamp=now) for name in city_names]
+    if not searches:
+        return []
+    db.add_all(searches)
+    await db.execute(rollup_upsert(), rollup_rows([(name, now) for name in city_names]))
+    await db.commit()
+    return [search.id for search in searches]
+
+def write_history(events: List[tuple]):
+    """
+    Inserts queued (city, timestamp) events as one multi-row transaction.
+    """
+    db = SessionLocal()
+    try:
+        db.execute(insert(SearchHistory), [{"city": city, "timestamp": ts} for city, ts in events])
+        db.execute(rollup_upsert(), rollup_rows(events))
+        db.commit()
+    finally:
+        db.close()
+
+history_writer = HistoryWriter(write_history, queue_size=HISTORY_QUEUE_SIZE, batch_size=HISTORY_BATCH_SIZE,
+                               flush_interval=HISTORY_FLUSH_INTERVAL)
+
+# Shown for places OpenWeather has no name for (open sea, remote cells); never recorded or prefetched
+UNNAMED_CITY = "Unknown"
+
+def is_city_name(name: Optional[str]) -> bool:
+    return bool(name) and name != UNNAMED_CITY
+
+async def record_searches(db: AsyncSession, city_names: List[str]) -> List[Optional[int]]:
+    """
+    Records history rows for named places and returns their ids; None for unnamed places,
+    and for every row when the write is deferred to history_writer.
+    """
+    named = [name for name in city_names if is_city_name(name)]
+    if history_writer.running:
+        history_writer.add(named)
+        return [None] * len(city_names)
+    ids = iter(await save_searches(db, named))
+    return [next(ids) if is_city_name(name) else None for name in city_names]
+
+# --- Retention ---
+# Search counts are already in search_rollup, so old search rows only need archiving
+retention = {"task": None, "last_run": None, "searches_purged": 0, "logins_purged": 0, "failures": 0}
+
+def rollup_logins(conn, rows):
+    counts = Counter((row.username, row.login_time.replace(hour=0, minute=0, second=0, microsecond=0))
+                     for row in rows if row.username is not None and row.login_time is not None)
+    if not counts:
+        return
+    stmt = (sqlite_insert if engine.dialect.name == "sqlite" else pg_insert)(LoginRollup)
+    stmt = stmt.on_conflict_do_update(index_elements=["username", "day"],
+                                      set_={"logins": LoginRollup.logins + stmt.excluded.logins})
+    conn.execute(stmt, [{"username": user, "day": day, "logins": n} for (user, day), n in counts.items()])
+
+def run_retention():
+    """
+    One pass of the retention job; blocking, so it runs in the threadpool.
+    """
+    now = datetime.utcnow()
+    searches = purge_table(engine, SearchHistory.__table__, "timestamp", now - timedelta(days=SEARCH_RETENTION_DAYS),
+                           RETENTION_BATCH_SIZE, archive_dir=RETENTION_ARCHIVE_DIR)
+    logins = purge_table(engine, LoginHistory.__table__, "login_time", now - timedelta(days=LOGIN_RETENTION_DAYS),
+                         RETENTION_BATCH_SIZE, rollup=rollup_logins, archive_dir=RETENTION_ARCHIVE_DIR)
+    if searches or logins:
+        reclaim_space(engine, ["search_history", "login_history"], RETENTION_VACUUM_PAGES)
+    retention["searches_purged"] += searches
+    retention["logins_purged"] += logins
+    retention["last_run"] = now.isoformat()
+    logger.info(f"Retention purged {searches} search rows and {logins} login rows")
+
+async def retention_loop():
+    await asyncio.sleep(60)  # keep startup fast; restarts are frequent on Render
+    while True:
+        try:
+            await run_in_threadpool(run_retention)
+        except Exception as e:
+            retention["failures"] += 1
+            logger.error(f"Retention run failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
+
 #--- Forecast Route ---
 @app.get("/forecast")
-def get_forecast(city: str, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_forecast(city: str, user: AuthUser = Depends(get_current_user)):
     logger.info(f"User {user.username} requested forecast for {city}")
 
     if not city:
         raise HTTPException(status_code=400, detail="City parameter is required")
 
-    url = f"http://api.openweathermap.org/data/2.5/forecast?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
-    res = requests.get(url)
-    if res.status_code != 200:
-        logger.error(f"Forecast API error: {res.text}")
-        raise HTTPException(status_code=res.status_code, detail=res.json())
+    status_code, data = await fetch_forecast(city)
+    if status_code != 200:
+        logger.error(f"Forecast API error: {data}")
+        raise HTTPException(status_code=status_code, detail=data)
 
-    data = res.json()
+    logger.info(f"Forecast for {city} returned successfully")
+    return forecast_summary(data, city)
 
+def forecast_summary(data: dict, city: str) -> dict:
     forecast = []
     for i in range(0, len(data.get("list", [])), 8):  # every 8 items = roughly 24h
         item = data["list"][i]
@@ -259,32 +1253,28 @@ def get_forecast(city: str, db: Session = Depends(get_db), user: User = Depends(
             "wind": f"{item['wind']['speed']} m/s",
             "humidity": f"{item['main']['humidity']}%"
         })
-
-    logger.info(f"Forecast for {city} returned successfully")
     return {
         "city": data.get("city", {}).get("name", city),
         "forecast": forecast
     }
 #---geolocation Route ---
 @app.get("/weather-by-coords")
-async def weather_by_coords(lat: float, lon: float, current_user: dict = Depends(get_current_user)):
-    # Use your weather API to get weather data by coordinates
-    # Example:
-    weather_data = get_weather_from_api_by_coords(lat, lon)
+async def weather_by_coords(lat: float, lon: float, db: AsyncSession = Depends(get_async_db),
+                            current_user: AuthUser = Depends(get_current_user)):
+    weather_data = await get_weather_from_api_by_coords(lat, lon)
+    await record_searches(db, [weather_data["city"]])
+    track_searches(current_user.id, [weather_data["city"]])
     return weather_data
-def get_weather_from_api_by_coords(lat: float, lon: float):
-    url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
-    res = requests.get(url)
-    data = res.json()
+async def get_weather_from_api_by_coords(lat: float, lon: float):
+    params = coords_query(lat, lon)
+    data = await fetch_current_weather(params)
     if data.get("cod") != 200:
         logger.error(f"Weather API error: {data}")
-        raise HTTPException(status_code=404, detail=data.get("message", "Location not found"))
+        raise HTTPException(status_code=weather_error_status(data), detail=data.get("message", "Location not found"))
     return {
-        "city": data.get("name", "Unknown"),
-        "temperature": f"{data.get('main', {}).get('temp', 'N/A')} °C",
-        "condition": data.get("weather")[0].get("description", "N/A").capitalize(),
-        "wind": f"{data.get('wind', {}).get('speed', 'N/A')} m/s",
-        "humidity": f"{data.get('main', {}).get('humidity', 'N/A')}%",
+        "city": params.get("q") or data.get("name") or UNNAMED_CITY,
+        **weather_summary(data),
+        "cell": data.get("cell"),
         "time": datetime.now().strftime("%H:%M:%S"),
         "date": datetime.now().strftime("%Y-%m-%d")
         
@@ -309,15 +1299,15 @@ async def subscribe(request: Request):
         if not endpoint or not keys:
             raise HTTPException(status_code=400, detail="Missing subscription endpoint or keys")
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS subscriptions (id INTEGER PRIMARY KEY, endpoint TEXT, keys TEXT)")
-        cursor.execute("INSERT INTO subscriptions (endpoint, keys) VALUES (?, ?)", (endpoint, keys))
-        conn.commit()
-        conn.close()
+        await save_subscription(endpoint, keys)
 
         logger.info("New subscription saved")
         return JSONResponse({"message": "Subscription saved successfully"}, status_code=201)
     except Exception as e:
         logger.error(f"Subscription error: {str(e)}")
         return JSONResponse({"error": str(e)}, status_code=500)
+
+async def save_subscription(endpoint: str, keys: str):
+    async with AsyncSessionLocal() as db:
+        db.add(Subscription(endpoint=endpoint, keys=keys))
+        await db.commit()
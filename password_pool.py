@@ -0,0 +1,115 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# --- Settings ---
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # cost factor; lower it for dev/test environments
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", "2"))  # 0 = hash on the shared threadpool
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))  # queued + running jobs before 503s
+
+_contexts = {}
+
+
+def get_context(rounds: int = BCRYPT_ROUNDS) -> CryptContext:
+    if rounds not in _contexts:
+        _contexts[rounds] = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return _contexts[rounds]
+
+
+# Run inside the worker processes
+def _hash(password: str, rounds: int) -> str:
+    return get_context(rounds).hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return get_context().verify(password, hashed)
+
+
+class PasswordPoolBusy(Exception):
+    """
+    Raised instead of queueing when the hashing queue is full.
+    """
+
+
+class PasswordPool:
+    """
+    Runs bcrypt hashing and verification in a bounded process pool, so a burst
+    of logins can't starve the threadpool that serves weather requests.
+    """
+    def __init__(self, workers: int = PASSWORD_POOL_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def start(self):
+        if self._executor is None and self.workers > 0:
+            # spawn, not fork: the parent has live threads and an event loop
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Password pool started with {self.workers} workers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        self.pending += 1
+        try:
+            if self.workers > 0:
+                result = await self._submit(fn, *args)
+            else:
+                result = await run_in_threadpool(fn, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    async def _submit(self, fn, *args):
+        # A worker that dies (e.g. OOM-killed) breaks the whole executor; replace it and retry once
+        for attempt in range(2):
+            self.start()
+            executor = self._executor
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                if self._executor is executor:
+                    logger.error("Password pool worker died, starting a new pool")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+                    self.restarts += 1
+                if attempt == 1:
+                    raise
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(_verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending, "queue_limit": self.queue_limit,
+                "completed": self.completed, "failed": self.failed, "rejected": self.rejected,
+                "restarts": self.restarts, "rounds": self.rounds}
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateBudget:
+    """
+    Token bucket that paces callers to `calls_per_minute`, evenly spread.
+    """
+    def __init__(self, calls_per_minute: float, burst: int = 1):
+        if calls_per_minute <= 0:
+            raise ValueError("calls_per_minute must be positive")
+        self.rate = calls_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PrefetchScheduler:
+    """
+    Periodically refreshes cache entries for the most searched cities before they expire.
+
+    `top_cities` returns the cities to keep warm, `jobs_for(city)` yields
+    (cache, key, load) triples, and loads run through `flights` so they coalesce
+    with request traffic. `plan` may turn the due jobs into fewer (key, load)
+    upstream calls. `sync(jobs)`, if given, runs before the due jobs are
+    planned so entries refreshed elsewhere (e.g. by another worker, through a
+    shared cache tier) can be picked up and skipped. Upstream calls are paced
+    by a per-minute budget; a budget of 0 disables the scheduler.
+    """
+    def __init__(self, top_cities: Callable[[], Awaitable[List[str]]],
+                 jobs_for: Callable[[str], Iterable[tuple]], flights,
+                 plan: Optional[Callable[[list], list]] = None,
+                 sync: Optional[Callable[[list], Awaitable]] = None,
+                 interval: float = 60, calls_per_minute: float = 30, refresh_at: float = 0.8):
+        self.top_cities = top_cities
+        self.jobs_for = jobs_for
+        self.flights = flights
+        self.plan = plan or (lambda jobs: [(key, load) for _, key, load in jobs])
+        self.sync = sync
+        self.interval = interval
+        self.budget = RateBudget(calls_per_minute) if calls_per_minute > 0 else None
+        self.refresh_at = refresh_at
+        self._task: Optional[asyncio.Task] = None
+        self.cycles = 0
+        self.refreshed = 0
+        self.skipped = 0
+        self.failures = 0
+
+    def start(self):
+        if self.budget is None:
+            logger.info("Prefetch disabled: no upstream call budget")
+            return
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info("Prefetch scheduler started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Prefetch scheduler stopped")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Prefetch cycle failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def is_due(self, cache, key) -> bool:
+        age = cache.age(key)
+        return age is None or age >= cache.ttl * self.refresh_at
+
+    async def run_once(self):
+        jobs = [job for city in await self.top_cities() for job in self.jobs_for(city)]
+        due = [job for job in jobs if self.is_due(job[0], job[1])]
+        if due and self.sync is not None:
+            await self.sync(due)
+            due = [job for job in due if self.is_due(job[0], job[1])]
+        self.skipped += len(jobs) - len(due)
+        for key, load in self.plan(due):
+            await self.budget.acquire()
+            try:
+                await self.flights.do(key, load)
+                self.refreshed += 1
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Prefetch of {key} failed: {e!r}")
+        self.cycles += 1
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "cycles": self.cycles,
+            "upstream_calls": self.refreshed,
+            "skipped_fresh": self.skipped,
+            "failures": self.failures,
+            "calls_per_minute": self.budget.rate * 60 if self.budget else 0,
+        }
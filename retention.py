@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Table, delete, select
+
+logger = logging.getLogger(__name__)
+
+
+def write_archive(directory: str, table_name: str, rows: list) -> str:
+    """
+    Writes rows to a zstd-compressed Parquet file named after their id range.
+    A rerun over the same rows overwrites the same file instead of duplicating it.
+    """
+    folder = os.path.join(directory, table_name)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{table_name}-{rows[0].id:012d}-{rows[-1].id:012d}.parquet")
+    data = pa.Table.from_pylist([dict(row._mapping) for row in rows])
+    pq.write_table(data, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def purge_table(engine, table: Table, time_column: str, cutoff: datetime, batch_size: int = 2000,
+                rollup: Optional[Callable] = None, archive_dir: str = "", pause: float = 0.05) -> int:
+    """
+    Deletes rows older than `cutoff` in batches of `batch_size`, oldest ids first.
+
+    Each batch is its own short transaction: DELETE ... RETURNING hands back the
+    removed rows, which are passed to `rollup(conn, rows)` and archived before the
+    commit, so a row is aggregated exactly once even if two workers run this at
+    the same time. `pause` seconds between batches let request writes through.
+    """
+    ids = (select(table.c.id).where(table.c[time_column] < cutoff)
+           .order_by(table.c.id).limit(batch_size).scalar_subquery())
+    stmt = delete(table).where(table.c.id.in_(ids)).returning(*table.c)
+    purged = 0
+    while True:
+        with engine.begin() as conn:
+            rows = sorted(conn.execute(stmt).all(), key=lambda row: row.id)
+            if rows:
+                if rollup is not None:
+                    rollup(conn, rows)
+                if archive_dir:
+                    write_archive(archive_dir, table.name, rows)
+        purged += len(rows)
+        if len(rows) < batch_size:
+            return purged
+        time.sleep(pause)
+
+
+def enable_incremental_vacuum(engine) -> bool:
+    """
+    Switches a SQLite database to incremental auto-vacuum. This takes a full
+    VACUUM, which rewrites the file under an exclusive lock, so run it offline:
+
+        python retention.py --enable-incremental-vacuum
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return False
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return True
+
+
+def reclaim_space(engine, tables: list, pages: int = 1000):
+    """
+    Returns freed pages to the filesystem. SQLite frees `pages` at a time so
+    no single step holds the write lock for long; this needs incremental
+    auto-vacuum (see enable_incremental_vacuum), otherwise freed pages are just
+    reused. Postgres gets a plain VACUUM ANALYZE, which makes the space
+    reusable without locking out writers.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name != "sqlite":
+            conn.exec_driver_sql(f"VACUUM (ANALYZE) {', '.join(tables)}")
+            return
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logger.info("Incremental auto-vacuum is off; freed pages stay in the file for reuse. "
+                        "Run `python retention.py --enable-incremental-vacuum` while the app is stopped")
+            return
+        freed, last = 0, None
+        while True:
+            free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free or free == last:
+                break
+            last = free
+            # The pragma frees one page per step and the sqlite3 cursor only steps once;
+            # executescript runs it to completion
+            conn.connection.dbapi_connection.executescript(f"PRAGMA incremental_vacuum({min(free, pages)})")
+            freed += min(free, pages)
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        if freed:
+            logger.info(f"Incremental vacuum freed {freed} pages")
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Offline maintenance for the history retention job")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="one-time full VACUUM switching SQLite to incremental auto-vacuum; stop the app first")
+    args = parser.parse_args()
+    if not args.enable_incremental_vacuum:
+        parser.print_help()
+    elif engine.dialect.name != "sqlite":
+        print("Only SQLite needs this; Postgres reclaims space with VACUUM")
+    elif enable_incremental_vacuum(engine):
+        print("Incremental auto-vacuum enabled")
+    else:
+        print("Incremental auto-vacuum was already enabled")
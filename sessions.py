@@ -0,0 +1,65 @@
+import time
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class RevocationList:
+    """
+    In-memory set of revoked session ids (jti), checked on every request
+    instead of the user_sessions table.
+
+    Each id is kept only until its session would have expired anyway, so the
+    set stays as small as the number of revoked-but-unexpired sessions.
+    """
+    def __init__(self, purge_every: int = 1000):
+        self.purge_every = purge_every
+        self._expires: Dict[str, float] = {}  # jti -> unix expiry
+        self._lock = threading.Lock()
+        self._adds_since_purge = 0
+        self.checks = 0
+        self.revoked_hits = 0
+        self.synced_at: Optional[float] = None
+
+    def load(self, entries: Iterable[Tuple[str, float]]):
+        """
+        Replaces the contents with (jti, expires_at) pairs, e.g. from the table at startup.
+        """
+        now = time.time()
+        fresh = {jti: exp for jti, exp in entries if exp > now}
+        with self._lock:
+            self._expires = fresh
+        self.synced_at = now
+
+    def add(self, jti: str, expires_at: float):
+        with self._lock:
+            self._expires[jti] = expires_at
+            self._adds_since_purge += 1
+            if self._adds_since_purge >= self.purge_every:
+                self._purge_locked()
+
+    def add_many(self, entries: Iterable[Tuple[str, float]]):
+        for jti, exp in entries:
+            self.add(jti, exp)
+
+    def is_revoked(self, jti: str) -> bool:
+        self.checks += 1
+        if jti in self._expires:
+            self.revoked_hits += 1
+            return True
+        return False
+
+    def purge(self):
+        with self._lock:
+            self._purge_locked()
+
+    def _purge_locked(self):
+        now = time.time()
+        self._expires = {jti: exp for jti, exp in self._expires.items() if exp > now}
+        self._adds_since_purge = 0
+
+    def __len__(self):
+        return len(self._expires)
+
+    def stats(self) -> dict:
+        return {"revoked": len(self._expires), "checks": self.checks,
+                "revoked_hits": self.revoked_hits, "synced_at": self.synced_at}
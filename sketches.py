@@ -0,0 +1,274 @@
+import math
+import time
+import heapq
+import base64
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class SpaceSaving:
+    """
+    Approximate top-k counter (Metwally et al.) in `capacity` slots. Every item
+    whose true count exceeds total/capacity is guaranteed to be tracked, and a
+    tracked item's count overestimates the truth by at most its `error`.
+    """
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self.counts: Dict[str, list] = {}  # item -> [count, error]
+        self._heap: List[tuple] = []       # one (count, item) entry per item, possibly outdated
+        self.total = 0
+
+    def add(self, item: str, n: int = 1):
+        self.total += n
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += n
+            return
+        floor = self._evict() if len(self.counts) >= self.capacity else 0
+        self.counts[item] = [floor + n, floor]
+        heapq.heappush(self._heap, (floor + n, item))
+
+    def _evict(self) -> int:
+        # Counts only grow, so an outdated heap entry just gets pushed back with its real count
+        while True:
+            count, item = heapq.heappop(self._heap)
+            actual = self.counts[item][0]
+            if actual == count:
+                del self.counts[item]
+                return count
+            heapq.heappush(self._heap, (actual, item))
+
+    def _floor(self) -> int:
+        """
+        Upper bound on the count of any item that isn't tracked.
+        """
+        return min(c for c, _ in self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other: "SpaceSaving"):
+        """
+        Folds `other` into this summary; the result keeps the same error guarantees.
+        """
+        floor_a, floor_b = self._floor(), other._floor()
+        merged = {}
+        for item in set(self.counts) | set(other.counts):
+            ca, ea = self.counts.get(item, (floor_a, floor_a))
+            cb, eb = other.counts.get(item, (floor_b, floor_b))
+            merged[item] = [ca + cb, ea + eb]
+        keep = heapq.nlargest(self.capacity, merged.items(), key=lambda kv: kv[1][0])
+        self.counts = {item: entry for item, entry in keep}
+        self._heap = [(entry[0], item) for item, entry in keep]
+        heapq.heapify(self._heap)
+        self.total += other.total
+
+    def top(self, n: int) -> List[tuple]:
+        """
+        (item, count, error) for the n largest counts.
+        """
+        best = heapq.nlargest(n, self.counts.items(), key=lambda kv: kv[1][0])
+        return [(item, count, error) for item, (count, error) in best]
+
+    def __len__(self):
+        return len(self.counts)
+
+    def to_dict(self) -> dict:
+        return {"capacity": self.capacity, "total": self.total,
+                "counts": {item: list(entry) for item, entry in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SpaceSaving":
+        sketch = cls(data["capacity"])
+        sketch.total = data["total"]
+        sketch.counts = {item: list(entry) for item, entry in data["counts"].items()}
+        sketch._heap = [(entry[0], item) for item, entry in sketch.counts.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+class HyperLogLog:
+    """
+    Distinct-count estimator in 2**precision one-byte registers (4KB at the
+    default), with a standard error of about 1.04 / sqrt(2**precision), ~1.6%.
+    """
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, item: str):
+        x = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)  # linear counting for small sets
+        return round(estimate)
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_dict(self) -> dict:
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HyperLogLog":
+        sketch = cls(data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class WindowedSketch:
+    """
+    A ring of sketches, one per `slice_seconds`, covering the last `slices`
+    slices. Queries merge the slices that overlap the requested window.
+    """
+    def __init__(self, kind, slice_seconds: int, slices: int, **params):
+        self.kind = kind
+        self.params = params
+        self.slice_seconds = slice_seconds
+        self.slices = slices
+        self._data: Dict[int, object] = {}
+        self._dirty = set()
+
+    @property
+    def span(self) -> int:
+        return self.slice_seconds * self.slices
+
+    def _start(self, now: float) -> int:
+        return int(now // self.slice_seconds) * self.slice_seconds
+
+    def starts(self, window: float, now: Optional[float] = None) -> List[int]:
+        """
+        Slice start times overlapping the last `window` seconds, capped at the ring's span.
+        """
+        now = time.time() if now is None else now
+        current = self._start(now)
+        oldest = self._start(now - min(window, self.span))
+        count = min(self.slices, (current - oldest) // self.slice_seconds + 1)
+        return [current - i * self.slice_seconds for i in range(count)]
+
+    def current(self, now: Optional[float] = None):
+        start = self._start(time.time() if now is None else now)
+        sketch = self._data.get(start)
+        if sketch is None:
+            sketch = self._data[start] = self.kind(**self.params)
+            oldest = start - self.span
+            for old in [s for s in self._data if s <= oldest]:
+                del self._data[old]
+        self._dirty.add(start)
+        return sketch
+
+    def merged(self, window: float, extra: Iterable = ()):
+        result = self.kind(**self.params)
+        for start in self.starts(window):
+            if start in self._data:
+                result.merge(self._data[start])
+        for sketch in extra:
+            result.merge(sketch)
+        return result
+
+    def take_dirty(self) -> Dict[int, dict]:
+        """
+        Serialized slices changed since the last call.
+        """
+        dirty, self._dirty = self._dirty, set()
+        return {start: self._data[start].to_dict() for start in dirty if start in self._data}
+
+
+class SketchExchange:
+    """
+    Shares windowed sketches between workers through a shared cache backend
+    (see weather_cache). Each worker periodically publishes the slices it
+    changed under its own id, and queries merge the local sketch with every
+    other worker's slices for the window. Workers stay in the registry for the
+    longest sketch span, so slices of a restarted or retired worker keep
+    counting until they age out. Without a backend, queries are local.
+    """
+    def __init__(self, backend, sketches: Dict[str, WindowedSketch], worker_id: str, interval: float = 10):
+        self.backend = backend
+        self.sketches = sketches
+        self.worker_id = worker_id
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.failures = 0
+        self.read_failures = 0
+        self.workers: List[str] = []  # seen recently, i.e. still running
+        # A worker's slices are read for as long as the widest window can reach them
+        self.retain = max((ws.span + ws.slice_seconds for ws in sketches.values()), default=0)
+
+    def _registry_key(self) -> tuple:
+        return ("sketch", "workers")
+
+    def start(self):
+        if self._task is None and self.backend is not None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Sketch exchange started as {self.worker_id}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            updates = {name: ws.take_dirty() for name, ws in self.sketches.items()}
+            try:
+                await run_in_threadpool(self.publish, updates)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Sketch publish failed: {e!r}")
+
+    def publish(self, updates: Dict[str, Dict[int, dict]]):
+        for name, slices in updates.items():
+            for start, payload in slices.items():
+                self.backend.set(("sketch", name, start, self.worker_id), payload)
+                self.published += 1
+        # Registry of workers by last publish; a lost concurrent update is repaired on the next publish
+        now = time.time()
+        hit = self.backend.get(self._registry_key())
+        workers = hit[0] if hit else {}
+        workers[self.worker_id] = now
+        workers = {w: seen for w, seen in workers.items() if now - seen < max(self.retain, 30 * self.interval)}
+        self.backend.set(self._registry_key(), workers)
+        self.workers = sorted(w for w, seen in workers.items() if now - seen < 30 * self.interval)
+
+    def remote(self, name: str, window: float) -> list:
+        """
+        Other workers' slices of sketch `name` for the window, or none if the
+        backend can't be read. Blocking; call from a thread.
+        """
+        if self.backend is None:
+            return []
+        ws = self.sketches[name]
+        try:
+            hit = self.backend.get(self._registry_key())
+            others = [w for w in (hit[0] if hit else {}) if w != self.worker_id]
+            keys = [("sketch", name, start, w) for w in others for start in ws.starts(window)]
+            return [ws.kind.from_dict(value) for value, _ in self.backend.get_many(keys).values()]
+        except Exception as e:
+            # Answer from this worker's slices rather than failing the query
+            self.read_failures += 1
+            logger.warning(f"Sketch read failed, using local slices only: {e!r}")
+            return []
+
+    def stats(self) -> dict:
+        return {"worker_id": self.worker_id, "shared": self.backend is not None, "workers": self.workers,
+                "published": self.published, "failures": self.failures, "read_failures": self.read_failures}
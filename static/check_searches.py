@@ -1,15 +1,15 @@
-import sqlite3
+import os
+import sys
+from sqlalchemy import text
 
-# Connect to your database
-conn = sqlite3.connect("weather.db")
-cursor = conn.cursor()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import engine
 
-print("Recent Searches:")
-for row in cursor.execute("SELECT * FROM search_history ORDER BY timestamp DESC LIMIT 10;"):
-    print(row)
+with engine.connect() as conn:
+    print("Recent Searches:")
+    for row in conn.execute(text("SELECT * FROM search_history ORDER BY timestamp DESC LIMIT 10")):
+        print(tuple(row))
 
-print("\nFavorite Cities:")
-for row in cursor.execute("SELECT * FROM favorite_cities ORDER BY id DESC;"):
-    print(row)
-
-conn.close()
+    print("\nFavorite Cities:")
+    for row in conn.execute(text("SELECT * FROM favorite_cities ORDER BY id DESC")):
+        print(tuple(row))
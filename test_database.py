@@ -0,0 +1,28 @@
+import pytest
+
+from database import (SQLITE_CACHE_MB, SQLITE_MAX_OVERFLOW, SQLITE_POOL_SIZE, async_url, make_engine,
+                      normalize_url)
+
+
+@pytest.mark.parametrize("url, sync, async_", [
+    ("postgres://u:p@db:5432/weather", "postgresql+psycopg://u:p@db:5432/weather",
+     "postgresql+asyncpg://u:p@db:5432/weather"),
+    ("postgresql://u:p@db/weather", "postgresql+psycopg://u:p@db/weather", "postgresql+asyncpg://u:p@db/weather"),
+    ("postgresql+psycopg2://db/weather", "postgresql+psycopg2://db/weather", "postgresql+asyncpg://db/weather"),
+    ("sqlite:///weather.db", "sqlite:///weather.db", "sqlite+aiosqlite:///weather.db"),
+])
+def test_urls_get_installed_drivers(url, sync, async_):
+    # A bare postgresql:// means psycopg2 on SQLAlchemy 2.0, which isn't in requirements.txt
+    assert normalize_url(url) == sync
+    assert async_url(url) == async_
+
+
+def test_sqlite_engine_keeps_a_small_memory_budget(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'budget.db'}")
+    with engine.connect() as conn:
+        cache_kb = -conn.exec_driver_sql("PRAGMA cache_size").scalar()
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    connections = engine.pool.size() + engine.pool._max_overflow
+    assert (cache_kb, connections) == (SQLITE_CACHE_MB * 1024, SQLITE_POOL_SIZE + SQLITE_MAX_OVERFLOW)
+    # Both engines at their limit stay within a small instance's memory
+    assert 2 * connections * SQLITE_CACHE_MB <= 128
@@ -0,0 +1,84 @@
+import math
+import random
+
+from geo import City, CityIndex, CoordinateGrid, EARTH_RADIUS_KM, geohash_center, geohash_encode
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+# --- CoordinateGrid ---
+def test_points_in_a_cell_share_its_key_and_centre():
+    rng, grid = random.Random(5), CoordinateGrid(cell_km=1.0)
+    for _ in range(2000):
+        lat, lon = rng.uniform(-89, 89), rng.uniform(-180, 180)
+        cell = grid.snap(lat, lon)
+        assert grid.snap(cell.lat, cell.lon).key == cell.key  # the centre lies in its own cell
+        assert haversine_km(lat, lon, cell.lat, cell.lon) <= 1.0, (lat, lon)
+    # Nearby points in one cell are fetched and cached once
+    centre = grid.snap(-1.2921, 36.8219)
+    nearby = [(centre.lat + dlat, centre.lon + dlon) for dlat in (-0.002, 0, 0.002) for dlon in (-0.002, 0, 0.002)]
+    assert {grid.snap(lat, lon).key for lat, lon in nearby} == {centre.key}
+
+
+def test_dateline_cells_stay_on_their_side():
+    grid = CoordinateGrid(cell_km=1.0)
+    east, west = grid.snap(0.5, 179.9999), grid.snap(0.5, -179.9999)
+    assert east.key != west.key
+    assert 179.9 < east.lon <= 180 and -180 <= west.lon < -179.9
+    assert grid.snap(0.5, 180).key == grid.snap(0.5, -180).key == west.key
+    for cell, lon in ((east, 179.9999), (west, -179.9999)):
+        assert haversine_km(0.5, lon, cell.lat, cell.lon) <= 1.0
+
+
+def test_pole_is_one_cell():
+    grid = CoordinateGrid(cell_km=1.0)
+    assert len({grid.snap(90, lon).key for lon in (-180, -90, 0, 45, 179.9)}) == 1
+    south = grid.snap(-90, 0)
+    assert -90 <= south.lat < -89.99 and -180 <= south.lon <= 180
+
+
+def test_known_geohash():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    lat, lon = geohash_center("u4pruydqqvj")
+    assert abs(lat - 57.64911) < 1e-5 and abs(lon - 10.40744) < 1e-5
+    cell = CoordinateGrid(geohash_precision=5).snap(57.64911, 10.40744)
+    assert cell.key == "gh:u4pru" and geohash_encode(cell.lat, cell.lon, 5) == "u4pru"
+
+
+def test_disabled_grid_passes_coordinates_through():
+    assert CoordinateGrid(cell_km=0).snap(1.5, 2.5) == ("pt:1.5,2.5", 1.5, 2.5)
+
+
+# --- CityIndex ---
+def random_cities(n: int, rng: random.Random) -> list:
+    return [City(i, f"city-{i}", "XX", rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(n)]
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(11)
+    cities = random_cities(1000, rng)
+    index = CityIndex(cities)
+    # Include the poles and the antimeridian, where lat/lon boxes would go wrong
+    queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(2000)]
+    queries += [(90, 0), (-90, 0), (0, 180), (0, -180), (10, 179.99)]
+    for lat, lon in queries:
+        city, km = index.nearest(lat, lon)
+        best = min(cities, key=lambda c: haversine_km(lat, lon, c.lat, c.lon))
+        assert city == best, (lat, lon)
+        assert abs(km - haversine_km(lat, lon, best.lat, best.lon)) < 1e-6
+
+
+def test_distance_is_great_circle_km():
+    index = CityIndex([City(2643743, "London", "GB", 51.5085, -0.1257), City(2988507, "Paris", "FR", 48.8534, 2.3488)])
+    city, km = index.nearest(48.86, 2.35)
+    assert city.name == "Paris" and km < 1
+    assert abs(index.nearest(51.5085, -0.1257)[1]) < 1e-6
+
+
+def test_empty_index_has_no_nearest():
+    assert CityIndex([]).nearest(0, 0) is None
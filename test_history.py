@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+from history import HistoryWriter
+
+
+def recording_writer(**kwargs):
+    batches = []
+    return HistoryWriter(lambda batch: batches.append([city for city, _ in batch]), **kwargs), batches
+
+
+def test_stop_flushes_a_batch_that_is_still_collecting():
+    async def scenario():
+        writer, batches = recording_writer(flush_interval=60)
+        writer.start()
+        writer.add(["Oslo", "Lima"])
+        await asyncio.sleep(0.01)  # the writer holds both, waiting for more until the interval ends
+        await writer.stop()
+        return writer, batches
+
+    writer, batches = asyncio.run(scenario())
+    assert batches == [["Oslo", "Lima"]]
+    assert writer.written == 2 and not writer.running
+
+
+def test_stop_waits_for_the_write_in_flight_and_drains_the_queue():
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def slow_write(batch):
+        started.set()
+        release.wait(5)
+        batches.append([city for city, _ in batch])
+
+    async def scenario():
+        writer = HistoryWriter(slow_write, batch_size=2, flush_interval=0)
+        writer.start()
+        writer.add(["a", "b"])
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        writer.add(["c", "d", "e"])  # queued behind the blocked write
+        stopping = asyncio.ensure_future(writer.stop())
+        await asyncio.sleep(0.01)
+        assert not stopping.done()
+        release.set()
+        await stopping
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
+    assert writer.stats()["written"] == 5 and writer.stats()["dropped"] == 0
+
+
+def test_batches_are_capped_at_batch_size():
+    async def scenario():
+        writer, batches = recording_writer(batch_size=3, flush_interval=60)
+        writer.start()
+        writer.add([str(i) for i in range(7)])
+        await asyncio.sleep(0.05)
+        written_before_stop = list(batches)
+        await writer.stop()
+        return written_before_stop, batches
+
+    before, batches = asyncio.run(scenario())
+    assert before == [["0", "1", "2"], ["3", "4", "5"]]  # full batches go out without waiting
+    assert batches[-1] == ["6"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    async def scenario():
+        writer, batches = recording_writer(queue_size=2, flush_interval=60)
+        writer.start()
+        writer.add(["a", "b", "c", "d"])  # the writer task has not taken anything yet
+        await writer.stop()
+        return writer, batches
+
+    writer, batches = asyncio.run(scenario())
+    assert writer.enqueued == 2 and writer.dropped == 2
+    assert sum(batches, []) == ["a", "b"]
+
+
+def test_failed_write_is_counted_and_the_writer_keeps_going():
+    calls = []
+
+    def flaky_write(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+
+    async def scenario():
+        writer = HistoryWriter(flaky_write, flush_interval=0)
+        writer.start()
+        writer.add(["a"])
+        await asyncio.sleep(0.02)
+        writer.add(["b"])
+        await writer.stop()
+        return writer
+
+    stats = asyncio.run(scenario()).stats()
+    assert (stats["failures"], stats["dropped"], stats["written"]) == (1, 1, 1)
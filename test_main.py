@@ -0,0 +1,605 @@
+import time
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from jose import ExpiredSignatureError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import main
+from prefetch import PrefetchScheduler
+from weather_cache import MemoryBackend, TTLCache
+
+
+def run(make_coro):
+    """
+    Runs a scenario on a fresh loop; pooled aiosqlite connections are bound to the loop that opened them.
+    """
+    async def scenario():
+        try:
+            return await make_coro()
+        finally:
+            await main.async_engine.dispose()
+    return asyncio.run(scenario())
+
+
+# --- Stale-while-revalidate ---
+def counting_loader(cache, key, value, calls, delay=0.01):
+    async def load():
+        calls.append(key)
+        await asyncio.sleep(delay)
+        await main.cache_store(cache, key, value)
+        return value
+    return load
+
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    cache, calls = TTLCache(ttl=60, hard_ttl=600), []
+    cache.set("k", "old", age=120)
+    load = counting_loader(cache, "k", "new", calls)
+
+    async def scenario():
+        served = await asyncio.gather(*[main.cached_fetch(cache, "k", load) for _ in range(3)])
+        await asyncio.sleep(0.05)  # let the background refresh finish
+        return served, await main.cached_fetch(cache, "k", load)
+
+    served, after = run(scenario)
+    assert served == ["old", "old", "old"]  # nobody waited for upstream
+    assert calls == ["k"]                   # one refresh for all of them
+    assert after == "new"
+    assert cache.lookup("k") == ("new", True)
+
+
+def test_failed_refresh_keeps_the_stale_entry():
+    cache = TTLCache(ttl=60, hard_ttl=600)
+    cache.set("k", "old", age=120)
+
+    async def load():
+        raise main.UpstreamError(502, "down")
+
+    async def scenario():
+        first = await main.cached_fetch(cache, "k", load)
+        await asyncio.sleep(0.01)
+        return first, await main.cached_fetch(cache, "k", load)
+
+    assert run(scenario) == ("old", "old")
+
+
+def test_past_hard_ttl_waits_for_upstream():
+    cache, calls = TTLCache(ttl=60, hard_ttl=600), []
+    cache.set("k", "ancient", age=700)
+    load = counting_loader(cache, "k", "new", calls)
+
+    assert run(lambda: main.cached_fetch(cache, "k", load)) == "new"
+    assert calls == ["k"]
+
+
+def test_fresh_entry_skips_upstream():
+    cache, calls = TTLCache(ttl=60, hard_ttl=600), []
+    cache.set("k", "cached", age=10)
+    assert run(lambda: main.cached_fetch(cache, "k", counting_loader(cache, "k", "new", calls))) == "cached"
+    assert calls == []
+
+
+# --- Stateless auth ---
+def make_user(username: str) -> int:
+    with main.SessionLocal() as db:
+        user = main.User(username=username, hashed_password="x")
+        db.add(user)
+        db.commit()
+        return user.id
+
+
+def test_uid_ver_token_is_accepted_from_the_user_cache():
+    uid = make_user("stateless@example.com")
+    token = main.create_access_token({"sub": "stateless@example.com", "uid": uid, "ver": 0})
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            first = await main.get_current_user(token, db)
+        # The second request is served from user_cache without touching the database
+        return first, await main.get_current_user(token, None)
+
+    first, second = run(scenario)
+    assert first.id == second.id == uid
+    assert first.username == "stateless@example.com"
+
+
+def test_password_reset_rejects_tokens_with_the_old_version():
+    uid = make_user("reset@example.com")
+    token = main.create_access_token({"sub": "reset@example.com", "uid": uid, "ver": 0})
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            await main.get_current_user(token, db)  # warm user_cache with version 0
+            await main.forgot_password(main.ForgotPasswordRequest(username="reset@example.com",
+                                                                  new_password="newsecret"), db)
+            with pytest.raises(main.HTTPException) as rejected:
+                await main.get_current_user(token, db)
+            fresh = main.create_access_token({"sub": "reset@example.com", "uid": uid, "ver": 1})
+            return rejected, await main.get_current_user(fresh, db)
+
+    rejected, user = run(scenario)
+    assert rejected.value.status_code == 401
+    assert user.token_version == 1
+
+
+def test_token_for_a_deleted_user_is_rejected():
+    token = main.create_access_token({"sub": "ghost@example.com", "uid": 999999, "ver": 0})
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            with pytest.raises(main.HTTPException) as rejected:
+                await main.get_current_user(token, db)
+            return rejected
+
+    assert run(scenario).value.status_code == 401
+
+
+# --- Verified-token cache ---
+def test_repeat_decodes_skip_the_signature_check(monkeypatch):
+    token = main.create_access_token({"sub": "cached@example.com"})
+    main.decode_token(token)
+    calls = []
+    monkeypatch.setattr(main.jwt, "decode", lambda *args, **kwargs: calls.append(1))
+    assert main.decode_token(token)["sub"] == "cached@example.com"
+    assert calls == []
+
+
+def test_cached_payload_past_its_exp_is_not_served():
+    # The cache TTL can outlive a short token; the entry's own exp has to win
+    token = main.create_access_token({"sub": "expired@example.com"}, expires_delta=timedelta(seconds=-5))
+    digest = hashlib.sha256(token.encode()).digest()
+    main.token_cache.set(digest, {"sub": "expired@example.com", "exp": time.time() - 5})
+    with pytest.raises(ExpiredSignatureError):
+        main.decode_token(token)
+
+    async def scenario():
+        with pytest.raises(main.HTTPException) as rejected:
+            await main.get_current_user(token, None)
+        return rejected
+
+    assert run(scenario).value.status_code == 401
+
+
+def test_token_expiring_after_it_was_cached_is_rejected():
+    token = main.create_access_token({"sub": "short@example.com"}, expires_delta=timedelta(seconds=1))
+    main.decode_token(token)
+    time.sleep(2.1)  # jose compares whole seconds and rejects only once now > exp
+    with pytest.raises(ExpiredSignatureError):
+        main.decode_token(token)
+
+
+# --- Prefetch ---
+def test_prefetch_reuses_entries_refreshed_by_another_worker(monkeypatch):
+    shared = MemoryBackend()
+    monkeypatch.setattr(main, "shared_cache", shared)
+    # Another worker already refreshed Sharedville; this worker has never seen it
+    shared.set(("weather", "city", "sharedville"), {"cod": 200, "name": "Sharedville"})
+    shared.set(("forecast", "sharedville"), [200, {"list": []}])
+    calls = []
+
+    async def fetch(path, params):
+        calls.append((path, params.get("q")))
+        raise main.UpstreamError(502, "down")
+
+    monkeypatch.setattr(main.upstream, "fetch", fetch)
+
+    async def top():
+        return ["Sharedville", "Lonelyville"]
+
+    scheduler = PrefetchScheduler(top, main.prefetch_jobs, main.upstream_flights, plan=main.prefetch_plan,
+                                  sync=main.prefetch_sync, calls_per_minute=6000)
+    run(scheduler.run_once)
+    assert sorted(calls) == [("/forecast", "Lonelyville"), ("/weather", "Lonelyville")]
+    assert scheduler.skipped == 2
+    assert main.weather_cache.lookup(("weather", "city", "sharedville")) == ({"cod": 200, "name": "Sharedville"}, True)
+
+
+# --- Batch weather ---
+def weather_payload(name: str) -> dict:
+    return {"cod": 200, "id": 0, "name": name, "main": {"temp": 12.5, "humidity": 70},
+            "weather": [{"description": "light rain"}], "wind": {"speed": 3.1}}
+
+
+def test_batch_reports_any_failed_item_on_its_own(monkeypatch):
+    async def fetch_json(path, params):
+        if params["q"] == "Brokenville":
+            raise KeyError("list")  # anything, not just an UpstreamError
+        if params["q"] == "Downville":
+            raise main.UpstreamError(504, "Weather service timed out")
+        return 200, weather_payload(params["q"])
+
+    monkeypatch.setattr(main.upstream, "fetch_json", fetch_json)
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            return await main.weather_batch(["Brokenville", "Downville", "Fineville"], [], db, user_id=1)
+
+    results = run(scenario)["results"]
+    assert results[0] == {"query": "Brokenville", "error": "Weather service unavailable", "status": 502}
+    assert results[1] == {"query": "Downville", "error": "Weather service timed out", "status": 504}
+    assert results[2]["city"] == "Fineville" and results[2]["temperature"] == "12.5 °C"
+
+
+# --- Sessions and refresh tokens ---
+def claims(token: str) -> dict:
+    return main.jwt.get_unverified_claims(token)
+
+
+async def open_session(db, uid: int) -> dict:
+    return await main.issue_tokens(db, await db.get(main.User, uid), "pytest")
+
+
+async def session_row(jti: str):
+    async with main.AsyncSessionLocal() as db:
+        return await main.get_session(db, jti)
+
+
+async def rejected(coro) -> int:
+    with pytest.raises(main.HTTPException) as failed:
+        await coro
+    return failed.value.status_code
+
+
+def test_refresh_rotates_the_session():
+    uid = make_user("rotate@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            first = await open_session(db, uid)
+            second = await main.rotate_refresh_token(db, first["refresh_token"])
+            user = await main.get_current_user(second["access_token"], db)
+            old_access = await rejected(main.get_current_user(first["access_token"], db))
+        return first, second, user, old_access, await session_row(claims(first["refresh_token"])["jti"])
+
+    first, second, user, old_access, old = run(scenario)
+    new_jti = claims(second["refresh_token"])["jti"]
+    assert claims(second["access_token"])["sid"] == new_jti != claims(first["refresh_token"])["jti"]
+    assert user.id == uid
+    assert old_access == 401  # the rotated session is in the revocation list
+    assert (old.revoked, old.revoked_reason, old.replaced_by) == (True, "rotated", new_jti)
+
+
+def test_concurrent_refreshes_share_one_successor():
+    uid = make_user("tabs@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            tokens = await open_session(db, uid)
+
+        async def refresh():
+            async with main.AsyncSessionLocal() as db:
+                return await main.rotate_refresh_token(db, tokens["refresh_token"])
+
+        return await asyncio.gather(refresh(), refresh())
+
+    a, b = run(scenario)
+    # The compare-and-swap lets one rotate; the other gets the same new session within the grace window
+    assert claims(a["refresh_token"])["jti"] == claims(b["refresh_token"])["jti"]
+
+
+def test_reuse_after_the_grace_window_revokes_every_session(monkeypatch):
+    monkeypatch.setattr(main, "REFRESH_REUSE_GRACE_SECONDS", 0)
+    uid = make_user("leaked@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            other = await open_session(db, uid)  # e.g. another device
+            stolen = await open_session(db, uid)
+            current = await main.rotate_refresh_token(db, stolen["refresh_token"])
+            await asyncio.sleep(0.01)
+            status = await rejected(main.rotate_refresh_token(db, stolen["refresh_token"]))
+            after = [await rejected(main.get_current_user(t["access_token"], db)) for t in (current, other)]
+        jtis = [claims(t["refresh_token"])["jti"] for t in (current, other)]
+        return status, after, [await session_row(jti) for jti in jtis]
+
+    status, after, sessions = run(scenario)
+    assert status == 401
+    assert after == [401, 401]
+    assert [(s.revoked, s.revoked_reason) for s in sessions] == [(True, "reuse"), (True, "reuse")]
+
+
+def test_logout_ends_the_session():
+    uid = make_user("logout@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            tokens = await open_session(db, uid)
+            user = await main.get_current_user(tokens["access_token"], db)
+            await main.logout(tokens["access_token"], db, user)
+            return (await rejected(main.get_current_user(tokens["access_token"], db)),
+                    await rejected(main.rotate_refresh_token(db, tokens["refresh_token"])),
+                    await session_row(claims(tokens["refresh_token"])["jti"]))
+
+    access, refresh, session = run(scenario)
+    assert access == refresh == 401
+    assert session.revoked_reason == "logout"  # not "reuse": a logged-out token is just rejected
+
+
+def test_password_reset_rejects_refresh_tokens():
+    uid = make_user("reset-refresh@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            tokens = await open_session(db, uid)
+            await main.forgot_password(main.ForgotPasswordRequest(username="reset-refresh@example.com",
+                                                                  new_password="newsecret"), db)
+            status = await rejected(main.rotate_refresh_token(db, tokens["refresh_token"]))
+        return status, await session_row(claims(tokens["refresh_token"])["jti"])
+
+    status, session = run(scenario)
+    assert status == 401
+    assert (session.revoked, session.revoked_reason) == (True, "reset")
+
+
+def test_token_types_are_not_interchangeable():
+    uid = make_user("types@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            tokens = await open_session(db, uid)
+            return (await rejected(main.get_current_user(tokens["refresh_token"], db)),
+                    await rejected(main.rotate_refresh_token(db, tokens["access_token"])),
+                    await rejected(main.rotate_refresh_token(db, "not-a-jwt")))
+
+    assert run(scenario) == (401, 401, 401)
+
+
+def test_sync_picks_up_other_workers_revocations():
+    uid = make_user("sync@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            tokens = await open_session(db, uid)
+        await main.load_revocations()
+        jti = claims(tokens["refresh_token"])["jti"]
+        # Another worker revokes the session straight in the table
+        await asyncio.sleep(0.01)
+        async with main.AsyncSessionLocal() as db:
+            await db.execute(main.update(main.UserSession).where(main.UserSession.jti == jti)
+                             .values(revoked=True, revoked_at=main.datetime.utcnow(), revoked_reason="logout"))
+            await db.commit()
+        before = main.revocations.is_revoked(jti)
+        await main.sync_revocations()
+        return before, main.revocations.is_revoked(jti)
+
+    assert run(scenario) == (False, True)
+
+
+# --- Retention ---
+def test_login_rollup_counts_purged_logins_per_user_and_day():
+    old = datetime(2020, 3, 1, 8, 30)
+    logins = [("roll-a", old), ("roll-a", old + timedelta(hours=5)), ("roll-a", old + timedelta(days=1)),
+              ("roll-b", old), (None, old)]
+    with main.SessionLocal() as db:
+        db.add_all([main.LoginHistory(username=user, login_time=ts) for user, ts in logins])
+        db.commit()
+
+    purged = main.purge_table(main.engine, main.LoginHistory.__table__, "login_time", datetime(2020, 6, 1),
+                              batch_size=2, rollup=main.rollup_logins, pause=0)
+    # A later run adds to the same day's row instead of replacing it
+    with main.SessionLocal() as db:
+        db.add(main.LoginHistory(username="roll-a", login_time=old + timedelta(hours=1)))
+        db.commit()
+    purged += main.purge_table(main.engine, main.LoginHistory.__table__, "login_time", datetime(2020, 6, 1),
+                               batch_size=2, rollup=main.rollup_logins, pause=0)
+
+    with main.SessionLocal() as db:
+        rows = db.query(main.LoginRollup).filter(main.LoginRollup.username.like("roll-%")).all()
+    assert purged == 6
+    assert sorted((r.username, r.day, r.logins) for r in rows) == [
+        ("roll-a", datetime(2020, 3, 1), 3), ("roll-a", datetime(2020, 3, 2), 1), ("roll-b", datetime(2020, 3, 1), 1)]
+
+
+# --- Search rollups ---
+def rollup_counts(prefix: str) -> dict:
+    with main.SessionLocal() as db:
+        rows = db.query(main.SearchRollup).filter(main.SearchRollup.city.like(f"{prefix}%")).all()
+    return {(r.city, r.bucket): r.searches for r in rows}
+
+
+def test_rollup_upsert_adds_to_an_existing_hour():
+    hour = datetime(2026, 5, 4, 10)
+    main.write_history([("Upsert-a", hour + timedelta(minutes=5)), ("Upsert-a", hour + timedelta(minutes=50)),
+                        ("Upsert-b", hour)])
+    main.write_history([("Upsert-a", hour + timedelta(minutes=59)), ("Upsert-a", hour + timedelta(hours=1))])
+    assert rollup_counts("Upsert-") == {("Upsert-a", hour): 3, ("Upsert-a", hour + timedelta(hours=1)): 1,
+                                        ("Upsert-b", hour): 1}
+
+
+def test_backfill_groups_existing_history_by_city_and_hour():
+    hour = datetime(2026, 5, 5, 7)
+    with main.SessionLocal() as db:
+        db.query(main.SearchRollup).delete()
+        db.query(main.SearchHistory).delete()
+        db.add_all([main.SearchHistory(city=city, timestamp=hour + timedelta(minutes=m)) for city, m in
+                    [("Back-a", 1), ("Back-a", 59), ("Back-a", 61), ("Back-b", 30), (None, 10)]])
+        db.commit()
+    main.backfill_rollups()
+    main.backfill_rollups()  # only the first run backfills
+    assert rollup_counts("Back-") == {("Back-a", hour): 2, ("Back-a", hour + timedelta(hours=1)): 1,
+                                      ("Back-b", hour): 1}
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            return (await main.top_cities(db, hour, 10),
+                    await main.top_cities(db, hour + timedelta(minutes=30), 10),  # widened to the hour
+                    await main.top_cities(db, hour + timedelta(hours=1), 10))
+
+    assert run(scenario) == ([("Back-a", 3), ("Back-b", 1)], [("Back-a", 3), ("Back-b", 1)], [("Back-a", 1)])
+
+
+@pytest.mark.parametrize("window, seconds", [("90m", 5400), ("24h", 86400), ("7d", 604800), ("2W", 1209600),
+                                             (" 1.5h ", 5400), ("45", 45), ("100000d", 366 * 86400)])
+def test_parse_window(window, seconds):
+    assert main.parse_window(window) == timedelta(seconds=seconds)
+
+
+@pytest.mark.parametrize("window", ["", "0h", "h", "-1d", "7y", "1e9"])
+def test_parse_window_rejects_bad_input(window):
+    with pytest.raises(main.HTTPException) as failed:
+        main.parse_window(window)
+    assert failed.value.status_code == 400
+
+
+# --- Group fetches ---
+def group_upstream(monkeypatch, names: dict, missing=()):
+    """
+    Fakes OpenWeather for cities with known ids; returns the list of calls made.
+    """
+    calls = []
+    for owm_id, name in names.items():
+        monkeypatch.setitem(main.city_ids, main.normalize_city(name), owm_id)
+
+    async def fetch_json(path, params):
+        calls.append((path, params.get("id") or params.get("q")))
+        await asyncio.sleep(0.01)
+        if path == "/group":
+            ids = [int(i) for i in params["id"].split(",")]
+            return 200, {"list": [{**weather_payload(names[i]), "id": i} for i in ids if i not in missing]}
+        return 200, weather_payload(params["q"])
+
+    monkeypatch.setattr(main.upstream, "fetch_json", fetch_json)
+    return calls
+
+
+def test_group_response_is_split_into_city_entries(monkeypatch):
+    calls = group_upstream(monkeypatch, {9001: "Group-a", 9002: "Group-b", 9003: "Group-c"}, missing={9003})
+    results = run(lambda: main.fetch_weather_many(["Group-a", "Group-b", "Group-c", "group-a"]))
+    assert [r["name"] for r in results] == ["Group-a", "Group-b", "Group-c", "Group-a"]
+    # One /group call, and a single fetch for the id the group response left out
+    assert calls == [("/group", "9001,9002,9003"), ("/weather", "Group-c")]
+    for name in ("Group-a", "Group-b", "Group-c"):
+        assert main.weather_cache.get(("weather", "city", name.lower()))["name"] == name
+
+
+def test_group_calls_are_chunked(monkeypatch):
+    monkeypatch.setattr(main, "OPENWEATHER_GROUP_LIMIT", 2)
+    names = {9100 + i: f"Chunk-{i}" for i in range(5)}
+    calls = group_upstream(monkeypatch, names)
+    results = run(lambda: main.fetch_weather_many(list(names.values())))
+    assert [r["name"] for r in results] == list(names.values())
+    assert calls == [("/group", "9100,9101"), ("/group", "9102,9103"), ("/group", "9104")]
+
+
+def test_single_lookups_share_an_in_flight_group_fetch(monkeypatch):
+    calls = group_upstream(monkeypatch, {9201: "Share-a", 9202: "Share-b"})
+
+    async def scenario():
+        batch = asyncio.ensure_future(main.fetch_weather_many(["Share-a", "Share-b"]))
+        await asyncio.sleep(0)  # the group fetch is now in flight
+        single = await main.fetch_current_weather({"q": "share-b"})
+        return await batch, single
+
+    batch, single = run(scenario)
+    assert single["name"] == batch[1]["name"] == "Share-b"
+    assert calls == [("/group", "9201,9202")]
+
+
+# --- Coordinate lookups ---
+def test_unnamed_location_is_shown_as_unknown_but_not_recorded(monkeypatch):
+    async def fetch_json(path, params):
+        return 200, weather_payload("")  # OpenWeather's name for open sea and other unnamed places
+
+    monkeypatch.setattr(main.upstream, "fetch_json", fetch_json)
+    user = main.CachedUser(1, "sailor@example.com", 0)
+    with main.SessionLocal() as db:
+        before = db.query(main.SearchHistory).count()
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            return await main.weather_by_coords(-40.123, -130.456, db, user)
+
+    assert run(scenario)["city"] == "Unknown"
+    with main.SessionLocal() as db:
+        assert db.query(main.SearchHistory).count() == before  # nothing to rank or prefetch
+
+
+def test_prefetch_skips_unnamed_places(monkeypatch):
+    monkeypatch.setattr(main, "LIVE_STATS_ENABLED", False)
+    monkeypatch.setattr(main, "PREFETCH_TOP_N", 1)
+    # Rows recorded before unnamed places were skipped
+    now = datetime.utcnow()
+    main.write_history([("Unknown", now)] * 30 + [("", now)] * 20 + [("Prefetch-real", now)] * 10)
+    assert run(main.prefetch_cities) == ["Prefetch-real"]
+
+
+# --- Password pool ---
+def test_saturated_password_pool_answers_503(monkeypatch):
+    monkeypatch.setattr(main.password_pool, "queue_limit", 0)
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            with pytest.raises(main.PasswordPoolBusy) as busy:
+                await main.register(main.RegisterUser(username="busy@example.com", password="secret123"), db)
+        return await main.password_pool_busy_handler(None, busy.value)
+
+    response = run(scenario)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+# --- Schema migration ---
+def test_sessions_table_from_before_rotation_is_migrated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(main.text("CREATE TABLE user_sessions (id INTEGER PRIMARY KEY, user_id INTEGER, jti VARCHAR, "
+                               "issued_at DATETIME, expires_at DATETIME, revoked BOOLEAN, client_info VARCHAR)"))
+        conn.execute(main.text("INSERT INTO user_sessions VALUES (1, 7, 'old-jti', '2026-01-01 00:00:00.000000', "
+                               "'2099-01-01 00:00:00.000000', 1, 'curl')"))
+    main.migrate_schema(engine)
+    main.migrate_schema(engine)  # a second start finds nothing to do
+
+    columns = {col["name"] for col in main.inspect(engine).get_columns("user_sessions")}
+    indexes = {index["name"] for index in main.inspect(engine).get_indexes("user_sessions")}
+    assert {"revoked_at", "revoked_reason", "replaced_by"} <= columns
+    assert "ix_user_sessions_revoked_at" in indexes
+    with Session(engine) as db:
+        rows = db.execute(main.select(main.UserSession.jti, main.UserSession.revoked_at)
+                          .where(main.UserSession.revoked == True)).all()
+    assert [tuple(row) for row in rows] == [("old-jti", None)]
+
+
+# --- Upstream errors ---
+def test_upstream_outage_is_not_reported_as_a_missing_city(monkeypatch):
+    body = {"cod": 500, "message": "Internal error"}
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(500, json=body)),
+                               base_url="http://openweather.test")
+    monkeypatch.setattr(main.upstream, "_client", client)
+    for load in (lambda: main.fetch_current_weather({"q": "Outageville"}), lambda: main.fetch_forecast("Outageville")):
+        with pytest.raises(main.UpstreamError) as failed:
+            run(load)
+        assert failed.value.status_code == 502
+    assert main.weather_cache.lookup(("weather", "city", "outageville")) is None  # nothing cached
+
+
+@pytest.mark.parametrize("data, status", [({"cod": "404", "message": "city not found"}, 404),
+                                          ({"cod": "400", "message": "wrong latitude"}, 400),
+                                          ({"cod": 401, "message": "Invalid API key"}, 502)])
+def test_weather_error_status(data, status):
+    assert main.weather_error_status(data) == status
+
+
+def test_sync_picks_up_a_revocation_that_committed_late():
+    uid = make_user("late-sync@example.com")
+
+    async def scenario():
+        async with main.AsyncSessionLocal() as db:
+            late, early = await open_session(db, uid), await open_session(db, uid)
+        await main.load_revocations()
+        stamped = main.datetime.utcnow()
+        async with main.AsyncSessionLocal() as db:
+            # The later-stamped revocation commits first and moves the sync cursor past the other one
+            for tokens, at in ((early, stamped + timedelta(seconds=1)), (late, stamped)):
+                await db.execute(main.update(main.UserSession)
+                                 .where(main.UserSession.jti == claims(tokens["refresh_token"])["jti"])
+                                 .values(revoked=True, revoked_at=at, revoked_reason="logout"))
+                await db.commit()
+                await main.sync_revocations()
+        return [main.revocations.is_revoked(claims(t["refresh_token"])["jti"]) for t in (early, late)]
+
+    assert run(scenario) == [True, True]
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from password_pool import PasswordPool, PasswordPoolBusy
+
+
+def test_full_queue_rejects_instead_of_waiting():
+    pool, release = PasswordPool(workers=0, queue_limit=2), threading.Event()
+
+    async def scenario():
+        running = [asyncio.ensure_future(pool._run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PasswordPoolBusy):
+            await pool._run(release.wait)
+        stats = pool.stats()
+        release.set()
+        await asyncio.gather(*running)
+        return stats
+
+    during = asyncio.run(scenario())
+    assert (during["pending"], during["rejected"]) == (2, 1)
+    assert pool.stats()["pending"] == 0 and pool.stats()["completed"] == 2
+
+
+def test_failed_jobs_are_not_counted_as_completed():
+    pool = PasswordPool(workers=0)
+
+    def broken():
+        raise ValueError("malformed hash")
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await pool._run(broken)
+        return await pool._run(lambda: "ok")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert (pool.pending, pool.completed, pool.failed) == (0, 1, 1)
+
+
+def test_hash_and_verify_round_trip():
+    pool = PasswordPool(workers=0, rounds=4)
+
+    async def scenario():
+        hashed = await pool.hash("secret123")
+        return await pool.verify("secret123", hashed), await pool.verify("wrong", hashed)
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_dead_worker_gets_a_new_pool():
+    pool = PasswordPool(workers=1)
+
+    async def scenario():
+        with pytest.raises(BrokenProcessPool):
+            await pool._run(os._exit, 1)  # the worker dies, as if OOM-killed, on the retry too
+        return await pool._run(abs, -3)
+
+    try:
+        assert asyncio.run(scenario()) == 3
+    finally:
+        pool.shutdown()
+    assert (pool.restarts, pool.failed, pool.completed) == (2, 1, 1)
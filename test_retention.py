@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, insert, select, text
+
+from retention import enable_incremental_vacuum, purge_table, reclaim_space
+
+NOW = datetime(2026, 6, 1, 12, 0)
+
+
+def make_table(tmp_path, old: int, new: int):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    table = Table("search_history", MetaData(),
+                  Column("id", Integer, primary_key=True), Column("city", String), Column("timestamp", DateTime))
+    table.metadata.create_all(engine)
+    rows = [{"city": f"old-{i}", "timestamp": NOW - timedelta(days=40, minutes=i)} for i in range(old)]
+    rows += [{"city": f"new-{i}", "timestamp": NOW - timedelta(days=1)} for i in range(new)]
+    with engine.begin() as conn:
+        conn.execute(insert(table), rows)
+    return engine, table
+
+
+def remaining(engine, table) -> list:
+    with engine.connect() as conn:
+        return sorted(conn.execute(select(table.c.city)).scalars())
+
+
+def test_purge_deletes_old_rows_in_batches(tmp_path):
+    engine, table = make_table(tmp_path, old=5, new=2)
+    batches = []
+    purged = purge_table(engine, table, "timestamp", NOW - timedelta(days=30), batch_size=2,
+                         rollup=lambda conn, rows: batches.append([row.id for row in rows]), pause=0)
+    assert purged == 5
+    assert batches == [[1, 2], [3, 4], [5]]  # oldest ids first
+    assert remaining(engine, table) == ["new-0", "new-1"]
+
+
+def test_purge_stops_cleanly_on_an_exact_multiple(tmp_path):
+    engine, table = make_table(tmp_path, old=4, new=1)
+    batches = []
+    purged = purge_table(engine, table, "timestamp", NOW - timedelta(days=30), batch_size=2,
+                         rollup=lambda conn, rows: batches.append(len(rows)), pause=0)
+    assert purged == 4
+    assert batches == [2, 2]  # the empty last pass rolls up nothing
+    assert remaining(engine, table) == ["new-0"]
+
+
+def test_failed_rollup_keeps_the_batch(tmp_path):
+    engine, table = make_table(tmp_path, old=3, new=0)
+
+    def rollup(conn, rows):
+        raise RuntimeError("rollup table locked")
+
+    try:
+        purge_table(engine, table, "timestamp", NOW - timedelta(days=30), batch_size=2, rollup=rollup, pause=0)
+    except RuntimeError:
+        pass
+    assert len(remaining(engine, table)) == 3  # the delete rolled back with it
+
+
+def test_archive_holds_exactly_the_purged_rows(tmp_path):
+    engine, table = make_table(tmp_path, old=5, new=2)
+    archive = tmp_path / "archive"
+    purge_table(engine, table, "timestamp", NOW - timedelta(days=30), batch_size=3,
+                archive_dir=str(archive), pause=0)
+    files = sorted(p.name for p in (archive / "search_history").iterdir())
+    assert files == ["search_history-000000000001-000000000003.parquet",
+                     "search_history-000000000004-000000000005.parquet"]
+    rows = [row for name in files for row in pq.read_table(archive / "search_history" / name).to_pylist()]
+    assert [row["id"] for row in rows] == [1, 2, 3, 4, 5]
+    assert rows[0] == {"id": 1, "city": "old-0", "timestamp": NOW - timedelta(days=40)}
+
+
+def fill_and_delete(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE blob (data TEXT)")
+        conn.exec_driver_sql("INSERT INTO blob SELECT hex(randomblob(2000)) FROM "
+                             "(WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 500) "
+                             "SELECT i FROM n)")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM blob")
+
+
+def freelist(engine) -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+
+def test_reclaim_space_returns_freed_pages(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'vacuum.db'}")
+    assert enable_incremental_vacuum(engine)
+    assert not enable_incremental_vacuum(engine)  # already on
+    fill_and_delete(engine)
+    assert freelist(engine) > 100
+    reclaim_space(engine, ["blob"], pages=50)
+    assert freelist(engine) == 0
+
+
+def test_reclaim_space_leaves_pages_without_incremental_vacuum(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plain.db'}")
+    fill_and_delete(engine)
+    free = freelist(engine)
+    reclaim_space(engine, ["blob"])
+    assert freelist(engine) == free > 0
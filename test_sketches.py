@@ -0,0 +1,173 @@
+import random
+from collections import Counter
+
+from sketches import HyperLogLog, SketchExchange, SpaceSaving, WindowedSketch
+from weather_cache import MemoryBackend
+
+
+def zipf_stream(n: int, items: int = 2000, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    cities = [f"city-{i}" for i in range(items)]
+    weights = [1 / (rank + 1) for rank in range(items)]
+    return rng.choices(cities, weights, k=n)
+
+
+def assert_space_saving_bounds(sketch: SpaceSaving, truth: Counter):
+    assert sketch.total == sum(truth.values())
+    for item, (count, error) in sketch.counts.items():
+        assert count - error <= truth[item] <= count, item
+    # Anything heavier than total/capacity must have been kept
+    for item, n in truth.items():
+        if n > sketch.total / sketch.capacity:
+            assert item in sketch.counts, item
+
+
+# --- SpaceSaving ---
+def test_space_saving_bounds_on_a_skewed_stream():
+    stream = zipf_stream(50000)
+    sketch = SpaceSaving(capacity=100)
+    for item in stream:
+        sketch.add(item)
+    truth = Counter(stream)
+    assert len(sketch) == 100
+    assert_space_saving_bounds(sketch, truth)
+    assert [item for item, _, _ in sketch.top(5)] == [item for item, _ in truth.most_common(5)]
+
+
+def test_space_saving_is_exact_below_capacity():
+    sketch = SpaceSaving(capacity=10)
+    for item in ["a", "b", "a", "c", "a", "b"]:
+        sketch.add(item)
+    assert sketch.top(3) == [("a", 3, 0), ("b", 2, 0), ("c", 1, 0)]
+
+
+def test_merged_space_saving_keeps_the_bounds():
+    # Two workers see different parts of the traffic; the merge answers for all of it
+    stream = zipf_stream(60000)
+    shards = [SpaceSaving(capacity=100) for _ in range(3)]
+    for i, item in enumerate(stream):
+        shards[i % 3].add(item)
+    merged = SpaceSaving(capacity=100)
+    for shard in shards:
+        merged.merge(shard)
+    truth = Counter(stream)
+    assert len(merged) == 100
+    assert_space_saving_bounds(merged, truth)
+    assert [item for item, _, _ in merged.top(5)] == [item for item, _ in truth.most_common(5)]
+
+
+def test_space_saving_round_trips_through_dict():
+    sketch = SpaceSaving(capacity=5)
+    for item in zipf_stream(500, items=50):
+        sketch.add(item)
+    copy = SpaceSaving.from_dict(sketch.to_dict())
+    assert copy.top(5) == sketch.top(5) and copy.total == sketch.total
+    copy.add("new-city")  # the rebuilt heap still evicts correctly
+    assert len(copy) == 5 and "new-city" in copy.counts
+
+
+# --- HyperLogLog ---
+def test_hll_estimates_within_tolerance():
+    for n in (100, 5000, 100000):
+        hll = HyperLogLog()
+        for i in range(n):
+            hll.add(f"user-{i}")
+        # Three standard errors at precision 12
+        assert abs(hll.count() - n) <= 0.05 * n, n
+
+
+def test_hll_ignores_repeats():
+    hll = HyperLogLog()
+    for _ in range(3):
+        for i in range(1000):
+            hll.add(f"user-{i}")
+    assert abs(hll.count() - 1000) <= 50
+
+
+def test_hll_merge_equals_the_union():
+    a, b, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(30000):
+        a.add(f"user-{i}")
+        union.add(f"user-{i}")
+    for i in range(20000, 50000):
+        b.add(f"user-{i}")
+        union.add(f"user-{i}")
+    a.merge(b)
+    assert a.registers == union.registers
+    assert abs(a.count() - 50000) <= 0.05 * 50000
+
+
+def test_hll_round_trips_through_dict():
+    hll = HyperLogLog(precision=10)
+    for i in range(500):
+        hll.add(str(i))
+    copy = HyperLogLog.from_dict(hll.to_dict())
+    assert copy.precision == 10 and copy.registers == hll.registers
+
+
+# --- WindowedSketch ---
+def test_windowed_sketch_merges_only_the_requested_slices(monkeypatch):
+    ws = WindowedSketch(SpaceSaving, slice_seconds=60, slices=3, capacity=10)
+    now = 6000.0
+    for age, item in [(0, "now"), (60, "1m"), (120, "2m")]:
+        ws.current(now - age).add(item)
+    monkeypatch.setattr("sketches.time.time", lambda: now)
+    assert set(ws.merged(60).counts) == {"now", "1m"}
+    assert set(ws.merged(3600).counts) == {"now", "1m", "2m"}  # capped at the span
+
+
+def test_windowed_sketch_drops_slices_past_the_span():
+    ws = WindowedSketch(HyperLogLog, slice_seconds=60, slices=3, precision=8)
+    ws.current(6000).add("old")
+    ws.current(6000 + 3 * 60)  # a new slice a full span later pushes the old one out
+    assert 6000 not in ws._data
+    assert set(ws.take_dirty()) == {6000 + 3 * 60}
+    assert ws.take_dirty() == {}
+
+
+# --- SketchExchange ---
+def test_restarted_workers_slices_count_for_the_whole_window(monkeypatch):
+    clock = [100000.0]
+    monkeypatch.setattr("sketches.time.time", lambda: clock[0])
+
+    def worker(worker_id):
+        searchers = WindowedSketch(HyperLogLog, slice_seconds=3600, slices=24, precision=10)
+        return SketchExchange(MemoryBackend(), {"searchers": searchers}, worker_id=worker_id, interval=10)
+
+    old = worker("host:1")
+    for i in range(500):
+        old.sketches["searchers"].current().add(f"user-{i}")
+    old.publish({"searchers": old.sketches["searchers"].take_dirty()})
+
+    # The old process is gone; its replacement shares the backend and publishes well past the live cutoff
+    new = worker("host:2")
+    new.backend = old.backend
+    clock[0] += 301
+    new.publish({"searchers": {}})
+    assert new.workers == ["host:2"]
+    remote = new.remote("searchers", 86400)
+    assert len(remote) == 1 and abs(remote[0].count() - 500) <= 50
+
+    # Once its slices have left the window, the old worker leaves the registry too
+    clock[0] += new.retain
+    new.publish({"searchers": {}})
+    assert new.remote("searchers", 86400) == []
+    assert new.backend.get(("sketch", "workers"))[0].keys() == {"host:2"}
+
+
+class DownBackend:
+    def get(self, key):
+        raise ConnectionRefusedError(111, "Connection refused")
+
+    def get_many(self, keys):
+        raise ConnectionRefusedError(111, "Connection refused")
+
+
+def test_unreachable_store_falls_back_to_local_slices():
+    searchers = WindowedSketch(HyperLogLog, slice_seconds=3600, slices=24, precision=10)
+    exchange = SketchExchange(DownBackend(), {"searchers": searchers}, worker_id="host:1")
+    for i in range(100):
+        searchers.current().add(f"user-{i}")
+    remote = exchange.remote("searchers", 86400)
+    assert remote == [] and exchange.stats()["read_failures"] == 1
+    assert abs(searchers.merged(86400, remote).count() - 100) <= 5
@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+import pytest
+
+import upstream
+from upstream import SingleFlight, UpstreamError
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"temp": 20}
+
+        results = await asyncio.gather(*[flights.do("oslo", load) for _ in range(5)])
+        return flights, calls, results
+
+    flights, calls, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(r == {"temp": 20} for r in results)
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "shared": 4}
+
+
+def test_exception_is_shared_and_key_is_released():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+
+        results = await asyncio.gather(flights.do("k", fail), flights.do("k", fail), return_exceptions=True)
+        # A later call starts a new flight instead of reusing the failed one
+        retry = await flights.do("k", lambda: asyncio.sleep(0, result="ok"))
+        return calls, results, retry
+
+    calls, results, retry = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    assert retry == "ok"
+
+
+def test_cancelled_caller_does_not_cancel_the_fetch():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return "data"
+
+        leader = asyncio.ensure_future(flights.do("k", load))
+        follower = asyncio.ensure_future(flights.do("k", load))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader, await follower
+
+    leader, result = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert result == "data"
+
+
+def test_distinct_keys_fly_separately():
+    async def scenario():
+        flights = SingleFlight()
+        return await asyncio.gather(flights.do("a", lambda: asyncio.sleep(0.01, result="a")),
+                                    flights.do("b", lambda: asyncio.sleep(0.01, result="b"))), flights
+
+    results, flights = asyncio.run(scenario())
+    assert results == ["a", "b"]
+    assert flights.leaders == 2 and flights.shared == 0
+
+
+def test_start_returns_the_in_flight_task():
+    async def scenario():
+        flights = SingleFlight()
+        first = flights.start("k", lambda: asyncio.sleep(0.01, result=1))
+        second = flights.start("k", lambda: asyncio.sleep(0.01, result=2))
+        return first is second, await first
+
+    same, value = asyncio.run(scenario())
+    assert same and value == 1
+
+
+
+# --- fetch_json ---
+def mock_client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://openweather.test")
+
+
+def test_html_error_page_becomes_upstream_error(monkeypatch):
+    client = mock_client(lambda request: httpx.Response(502, text="<html><h1>Bad Gateway</h1></html>"))
+    monkeypatch.setattr(upstream, "_client", client)
+    with pytest.raises(UpstreamError) as failed:
+        asyncio.run(upstream.fetch_json("/weather", {"q": "Oslo"}))
+    assert failed.value.status_code == 502
+
+
+def test_empty_body_becomes_upstream_error(monkeypatch):
+    monkeypatch.setattr(upstream, "_client", mock_client(lambda request: httpx.Response(503)))
+    with pytest.raises(UpstreamError) as failed:
+        asyncio.run(upstream.fetch_json("/forecast", {"q": "Oslo"}))
+    assert failed.value.status_code == 502
+
+
+def test_json_error_is_passed_through(monkeypatch):
+    body = {"cod": "404", "message": "city not found"}
+    monkeypatch.setattr(upstream, "_client", mock_client(lambda request: httpx.Response(404, json=body)))
+    assert asyncio.run(upstream.fetch_json("/weather", {"q": "Nowhere"})) == (404, body)
+
+
+def test_rate_limit_and_server_errors_become_upstream_errors(monkeypatch):
+    for status, body, expected in [(429, {"cod": 429, "message": "quota"}, 503),
+                                   (500, {"cod": 500, "message": "Internal error"}, 502),
+                                   (503, {}, 502)]:
+        handler = lambda request, status=status, body=body: httpx.Response(status, json=body)
+        monkeypatch.setattr(upstream, "_client", mock_client(handler))
+        with pytest.raises(UpstreamError) as failed:
+            asyncio.run(upstream.fetch_json("/weather", {"q": "Oslo"}))
+        assert failed.value.status_code == expected, status
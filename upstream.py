@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# --- Settings ---
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "http://api.openweathermap.org/data/2.5")
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "50"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "5"))
+
+
+class UpstreamError(Exception):
+    """
+    Raised when OpenWeather cannot be reached or answers with an error.
+    """
+    def __init__(self, status_code: int, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# --- Shared Client ---
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=OPENWEATHER_BASE_URL,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            UPSTREAM_READ_TIMEOUT,
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+            read=UPSTREAM_READ_TIMEOUT,
+        ),
+    )
+
+
+async def start_client():
+    """
+    Opens the app-lifetime client. Called on startup.
+    """
+    global _client
+    if _client is None:
+        _client = _build_client()
+        logger.info("Upstream HTTP client started")
+
+
+async def close_client():
+    """
+    Closes the client and its pooled connections. Called on shutdown.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Upstream HTTP client closed")
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        # Startup hooks don't run for every entry point (scripts, bare TestClient)
+        _client = _build_client()
+    return _client
+
+
+async def fetch(path: str, params: dict) -> httpx.Response:
+    """
+    GETs an OpenWeather path on the shared pool. Transport failures become UpstreamError.
+    """
+    try:
+        return await get_client().get(path, params=params)
+    except httpx.TimeoutException as e:
+        logger.error(f"OpenWeather timeout on {path}: {e!r}")
+        raise UpstreamError(504, "Weather service timed out")
+    except httpx.HTTPError as e:
+        logger.error(f"OpenWeather request failed on {path}: {e!r}")
+        raise UpstreamError(502, "Weather service unavailable")
+
+
+async def fetch_json(path: str, params: dict) -> tuple:
+    """
+    fetch() returning (status_code, payload). A body that isn't a JSON object,
+    e.g. a proxy's HTML error page, becomes UpstreamError(502); rate limiting
+    (429) and server errors become UpstreamError(503) and (502), so callers
+    keep stale entries instead of caching or relaying the error as data.
+    """
+    res = await fetch(path, params)
+    try:
+        payload = res.json()
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        logger.error(f"OpenWeather returned a non-JSON {res.status_code} on {path}: {res.text[:200]!r}")
+        raise UpstreamError(502, "Weather service unavailable")
+    if res.status_code == 429:
+        logger.error(f"OpenWeather rate limited {path}: {payload}")
+        raise UpstreamError(503, "Weather service is busy, please retry")
+    if res.status_code >= 500:
+        logger.error(f"OpenWeather {res.status_code} on {path}: {payload}")
+        raise UpstreamError(502, payload.get("message") or "Weather service unavailable")
+    return res.status_code, payload
+
+
+# --- Request Coalescing ---
+class SingleFlight:
+    """
+    Lets only one fetch per key be in flight; concurrent callers for the same
+    key await that fetch and share its result or exception.
+    """
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        Returns the in-flight task for `key`, starting `fn` if there is none.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            # Run as its own task so a disconnecting leader doesn't cancel the fetch for everyone else
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return task
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        return await asyncio.shield(self.start(key, fn))
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "shared": self.shared}
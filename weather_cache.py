@@ -0,0 +1,400 @@
+import re
+import json
+import time
+import ssl
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+from urllib.parse import unquote, urlparse
+
+
+def normalize_city(city: str) -> str:
+    """
+    Canonical cache key for a city name: trimmed, lower-case, single-spaced.
+    """
+    return re.sub(r"\s+", " ", city.strip()).lower()
+
+
+class TTLCache:
+    """
+    Bounded in-process cache. Entries are fresh for `ttl` seconds and the least
+    recently used entry is evicted once `maxsize` is reached.
+
+    With `hard_ttl` > `ttl` an entry stays servable as stale until `hard_ttl`,
+    so callers can return it while refreshing it in the background.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 600, hard_ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hard_ttl = max(ttl, hard_ttl or ttl)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def lookup(self, key: Hashable) -> Optional[tuple]:
+        """
+        Returns (value, fresh) for a servable entry, or None on a miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value, _ = entry
+            age = time.monotonic() - stored_at
+            if age >= self.hard_ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if age >= self.ttl:
+                self.stale_hits += 1
+                return value, False
+            self.hits += 1
+            return value, True
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the value only while it is fresh.
+        """
+        hit = self.lookup(key)
+        if hit is None or not hit[1]:
+            return None
+        return hit[0]
+
+    def set(self, key: Hashable, value: Any, age: float = 0):
+        """
+        Stores `value`. A non-zero `age` back-dates the entry, e.g. when it was loaded from another tier.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now - age, value, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def age(self, key: Hashable) -> Optional[float]:
+        """
+        Seconds since `key` was stored, or None if absent. Doesn't touch counters or recency.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            return time.monotonic() - entry[0]
+
+    def held_for(self, key: Hashable) -> Optional[float]:
+        """
+        Seconds since this process last stored or touched `key`, regardless of
+        the entry's age. Used as the near-cache window in front of a shared tier.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            return time.monotonic() - entry[2]
+
+    def touch(self, key: Hashable) -> Optional[tuple]:
+        """
+        Restarts the held_for clock of `key`; returns (value, age) or None if absent.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            now = time.monotonic()
+            self._data[key] = (entry[0], entry[1], now)
+            return entry[1], now - entry[0]
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hard_ttl": self.hard_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# --- Shared Cache Backends ---
+# Second tier behind the in-process TTLCache. Every backend implements
+# get(key), get_many(keys) -> {key: (value, age_seconds)}, set(key, value)
+# and stats(); values must be JSON-serializable and freshness is left to the caller.
+
+def _key_text(key: Hashable) -> str:
+    return "|".join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+class MemoryBackend:
+    """
+    Process-local backend, for single-worker setups and local testing.
+    """
+    def __init__(self, max_age: float = 86400):
+        self.max_age = max_age
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, tuple]:
+        now, found = time.time(), {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(_key_text(key))
+                if entry is not None and now - entry[1] < self.max_age:
+                    found[key] = (json.loads(entry[0]), now - entry[1])
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[_key_text(key)] = (json.dumps(value), time.time())
+            self.writes += 1
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self._data), "hits": self.hits,
+                "misses": self.misses, "writes": self.writes}
+
+
+class DiskCache:
+    """
+    Backend in a local SQLite file (WAL mode), shared by every worker process
+    on the host and kept across restarts. Values are stored as JSON with their
+    wall-clock fetch time.
+    """
+    def __init__(self, path: str, max_age: float = 86400, purge_every: int = 1000):
+        self.path = path
+        self.max_age = max_age
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes_since_purge = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS upstream_cache "
+                         "(key TEXT PRIMARY KEY, payload TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        self.purge()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        """
+        Returns (value, age_seconds) or None.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, tuple]:
+        by_text = {_key_text(k): k for k in keys}
+        if not by_text:
+            return {}
+        marks = ",".join("?" * len(by_text))
+        rows = self._conn().execute(
+            f"SELECT key, payload, fetched_at FROM upstream_cache WHERE key IN ({marks})", list(by_text)
+        ).fetchall()
+        now = time.time()
+        found = {by_text[k]: (json.loads(payload), max(0.0, now - fetched_at)) for k, payload, fetched_at in rows}
+        self.hits += len(found)
+        self.misses += len(by_text) - len(found)
+        return found
+
+    def set(self, key: Hashable, value: Any):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO upstream_cache (key, payload, fetched_at) VALUES (?, ?, ?)",
+                         (_key_text(key), json.dumps(value), time.time()))
+        self.writes += 1
+        self._writes_since_purge += 1
+        if self._writes_since_purge >= self.purge_every:
+            self.purge()
+
+    def purge(self):
+        self._writes_since_purge = 0
+        with self._conn() as conn:
+            conn.execute("DELETE FROM upstream_cache WHERE fetched_at < ?", (time.time() - self.max_age,))
+
+    def stats(self) -> dict:
+        return {"backend": "disk", "path": self.path, "hits": self.hits,
+                "misses": self.misses, "writes": self.writes}
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache:
+    """
+    Backend on any Redis-protocol server, shared by every node. Speaks RESP
+    directly over one socket per thread; multi-gets are a single MGET and
+    entries expire server-side after `max_age`. rediss:// URLs connect over
+    TLS, and a username in the URL authenticates as that ACL user.
+    """
+    def __init__(self, url: str = "redis://localhost:6379/0", max_age: float = 86400,
+                 prefix: str = "weapp:", timeout: float = 1.0):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", "rediss"):
+            raise ValueError(f"Unsupported Redis URL scheme: {parsed.scheme!r}")
+        self.tls = parsed.scheme == "rediss"
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.max_age = max_age
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.tls:
+            try:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+            except OSError:
+                sock.close()
+                raise
+        self._local.sock, self._local.reader = sock, sock.makefile("rb")
+        setup = []
+        if self.password:
+            # Redis 6 ACLs: a bare AUTH password only works for the default user
+            setup.append(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            self._pipeline(setup)
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            finally:
+                self._local.sock = self._local.reader = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise RedisError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            if size < 0:
+                return None
+            data = self._local.reader.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _pipeline(self, commands: list) -> list:
+        """
+        Sends all commands in one write and reads the replies in order.
+        """
+        if getattr(self._local, "sock", None) is None:
+            self._connect()
+        try:
+            self._local.sock.sendall(b"".join(self._encode(cmd) for cmd in commands))
+            return [self._read_reply() for _ in commands]
+        except (OSError, RedisError):
+            self._close()  # reconnect on next use rather than reuse a desynced stream
+            raise
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, tuple]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        replies = self._pipeline([("MGET", *[self.prefix + _key_text(k) for k in keys])])[0]
+        now, found = time.time(), {}
+        for key, raw in zip(keys, replies):
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+            found[key] = (entry["v"], max(0.0, now - entry["t"]))
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: Hashable, value: Any):
+        payload = json.dumps({"v": value, "t": time.time()})
+        self._pipeline([("SET", self.prefix + _key_text(key), payload, "EX", max(1, int(self.max_age)))])
+        self.writes += 1
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "host": f"{self.host}:{self.port}", "tls": self.tls, "hits": self.hits,
+                "misses": self.misses, "writes": self.writes}
+
+
+def make_cache_backend(kind: str, max_age: float, disk_path: str = "weather_cache.db",
+                       redis_url: str = "redis://localhost:6379/0"):
+    """
+    Builds the shared tier named by `kind` ("disk", "redis", "memory" or "none").
+    """
+    kind = (kind or "none").lower()
+    if kind == "disk":
+        return DiskCache(disk_path, max_age=max_age)
+    if kind == "redis":
+        return RedisCache(redis_url, max_age=max_age)
+    if kind == "memory":
+        return MemoryBackend(max_age=max_age)
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown cache backend: {kind}")
@@ -13,11 +13,37 @@ def login(username: str, password: str) -> dict:
             data=f"username={username}&password={password}"
         )
         if res.ok:
-            return {"success": True, "access_token": res.json().get("access_token")}
+            data = res.json()
+            return {"success": True, "access_token": data.get("access_token"), "refresh_token": data.get("refresh_token")}
         return {"success": False, "error": res.json().get("detail", "Login failed")}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def refresh(refresh_token: str) -> dict:
+    """
+    Exchanges a refresh token for a new access/refresh token pair. The old refresh token stops working.
+    """
+    try:
+        res = requests.post(f"{BASE_URL}/token/refresh", json={"refresh_token": refresh_token})
+        if res.ok:
+            data = res.json()
+            return {"success": True, "access_token": data.get("access_token"), "refresh_token": data.get("refresh_token")}
+        return {"success": False, "error": res.json().get("detail", "Refresh failed")}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+def logout(token: str) -> dict:
+    """
+    Ends the session the access token belongs to.
+    """
+    try:
+        res = requests.post(f"{BASE_URL}/logout", headers={"Authorization": f"Bearer {token}"})
+        if res.ok:
+            return {"success": True, "message": res.json().get("message")}
+        return {"success": False, "error": res.json().get("detail", "Logout failed")}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 def register(username: str, password: str) -> dict:
     """
     Registers a new user.
@@ -48,6 +74,22 @@ def get_weather(city: str, token: str) -> dict:
     except Exception as e:
         return {"error": str(e)}
 
+def get_weather_batch(cities: list, token: str) -> dict:
+    """
+    Fetches current weather for several cities in one request.
+    """
+    try:
+        res = requests.post(
+            f"{BASE_URL}/weather/batch",
+            json={"cities": cities},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        if res.ok:
+            return res.json()
+        return {"error": res.json().get("detail", "Could not fetch weather")}
+    except Exception as e:
+        return {"error": str(e)}
+
 def get_forecast(city: str, token: str) -> dict:
     """
     Fetches forecast for a city.